@@ -72,7 +72,7 @@ async def extract_license_plate(
         print(f"✅ Image saved: {image_path}")
         
         # Extract plate and vehicle metadata using EnhancedVisionService
-        result = vision_service.extract_vehicle_metadata(image_path)
+        result = vision_service.extract_vehicle_metadata(image_path, camera_id)
         
         # Calculate processing time
         processing_time_ms = int((time.time() - start_time) * 1000)
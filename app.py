@@ -8,6 +8,11 @@ import os
 import queue
 import threading
 import hashlib
+import json
+import functools
+import itertools
+from collections import deque
+import logging
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -24,6 +29,18 @@ from services.temp_cleanup import TempFileCleanup
 from utils.indian_number_plates_guide import validate_license_plate
 
 from utils.internet_checker import check_internet_connection
+
+# Per-frame diagnostics go through logger.debug so they are not formatted or written at
+# the default level (set LOG_LEVEL=DEBUG to see them)
+logger = logging.getLogger(__name__)
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+# Multi-camera config is optional; resolved once here rather than re-imported per detection
+# (a failed import is not cached, so retrying it rescans sys.path every time)
+try:
+    from utils.camera_config import get_active_camera
+except ImportError:
+    get_active_camera = None
 from lpr_system import LPRSystem
 from web_dashboard import get_dashboard_html, get_root_html
 
@@ -31,8 +48,17 @@ from web_dashboard import get_dashboard_html, get_root_html
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", 8000))
 RTSP_URL = os.getenv("RTSP_URL")
+DB_FILE = os.getenv("DB_FILE", "lpr_logs.db")
+RTSP_TRANSPORT = os.getenv("RTSP_TRANSPORT", "tcp")  # tcp or udp (low-latency LAN)
+
+# FFmpeg capture options, computed once and picked up by every (re)connect
+os.environ.setdefault(
+    "OPENCV_FFMPEG_CAPTURE_OPTIONS",
+    f"rtsp_transport;{RTSP_TRANSPORT}|buffer_size;1024000|max_delay;500000|stimeout;5000000"
+)
 
 import requests
+from requests.adapters import HTTPAdapter
 import sqlite3
 import time
 from datetime import datetime
@@ -48,6 +74,23 @@ ROI = (int(os.getenv("PLATE_ROI_X", 200)), int(os.getenv("PLATE_ROI_Y", 400)),
 SHARPNESS_THRESHOLD = int(os.getenv("SHARPNESS_THRESHOLD", 50))  # Lower for easier detection
 MOTION_THRESHOLD = int(os.getenv("MOTION_THRESHOLD", 5))  # Lower for easier detection
 RETRY_ATTEMPTS = 2
+OCR_QUEUE_SIZE = int(os.getenv("OCR_QUEUE_SIZE", 100))  # pending plates before the oldest is dropped
+
+# Keep-alive session for the OCR worker's uploads to the local API
+api_session = requests.Session()
+api_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+class PlateTrack:
+    """Stability tracking for one plate position (slots: one per tracked plate, touched every frame)"""
+    __slots__ = ('bbox_history', 'stability_count', 'last_seen', 'first_seen', 'last_processed', 'confidence')
+    
+    def __init__(self, bbox, confidence, now):
+        self.bbox_history = deque([bbox], maxlen=5)  # last 5 positions for the variance check
+        self.stability_count = 0
+        self.last_seen = now
+        self.first_seen = now
+        self.last_processed = 0
+        self.confidence = confidence
 
 # Thread-safe global state for stability detection
 class GlobalState:
@@ -66,11 +109,10 @@ class GlobalState:
         self.ocr_queue = queue.Queue()
         self.ocr_worker_running = False
         self.ocr_worker_thread = None
-        self.last_cleanup_time = time.time()
         self.initialize_detectors()
         self.last_detection_time = 0
-        self.processed_vehicles = {}  # Tracks plate stability: {plate_key: {'bbox_history': [], 'stability_count': 0, ...}}
-        self.vehicle_queue = queue.Queue()
+        self.processed_vehicles = {}  # Tracks plate stability: {plate_key: PlateTrack}
+        self.vehicle_queue = queue.Queue(maxsize=OCR_QUEUE_SIZE)
         self.api_busy = False
         self.camera_instance = None
         self.last_frame = None
@@ -93,6 +135,7 @@ class GlobalState:
         self.license_plate_service = LlamaServerService() # Use Persistent Server Strategy
         self.mongodb_sync = MongoDBSync()
         self.temp_cleanup = TempFileCleanup(temp_dir="temp_screenshots", max_age_hours=1)
+        self.temp_cleanup.start()
         print("✅ Detectors initialized (CPU-optimized)")
 
 state = GlobalState()
@@ -178,7 +221,6 @@ def sync_to_cloud_and_cleanup(plate, vehicle_type, full_image_path, roi_image_pa
             record = {
                 "plate": plate,
                 "vehicle_type": vehicle_type,
-                "timestamp": datetime.now().isoformat(),
                 "full_image_path": full_image_path,
                 "roi_image_path": roi_image_path,
                 "api_response": api_response,
@@ -187,24 +229,79 @@ def sync_to_cloud_and_cleanup(plate, vehicle_type, full_image_path, roi_image_pa
             state.mongodb_sync.sync_record(record)
         
         # STAGE 15: Cleanup temp ROI image after processing
-        if state.temp_cleanup and os.path.exists(roi_image_path):
+        if state.temp_cleanup:
             filename = os.path.basename(roi_image_path)
             state.temp_cleanup.cleanup_specific_file(filename)
                 
     except Exception as e:
         print(f"❌ Cloud sync/cleanup error: {e}")
 
+# Detection logs are written by one dedicated thread that owns the SQLite connection
+# (client-server style): producers only enqueue rows, the writer inserts them in
+# batches. sqlite3 caches the prepared INSERT on that one long-lived connection.
+db_write_queue = queue.SimpleQueue()
+db_writer_thread = None
+db_writer_lock = threading.Lock()
+DB_BATCH_SIZE = 128
+DB_STOP = None  # sentinel: flush and exit
+
+def open_log_database():
+    """Open the logs database and create the table (writer thread only)"""
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute('''CREATE TABLE IF NOT EXISTS logs
+                 (id INTEGER PRIMARY KEY, plate TEXT, timestamp TEXT, type TEXT, 
+                  confidence REAL, image_path TEXT, roi_image_path TEXT, api_response TEXT)''')
+    conn.commit()
+    return conn
+
+def db_writer():
+    """Insert queued rows with one executemany + commit per batch; rows that arrive
+    while a batch is being written share the next commit"""
+    global db_writer_thread
+    try:
+        conn = open_log_database()
+    except Exception as e:
+        # Queued rows stay queued; the next log_to_database call starts a new writer
+        print(f"Database error: cannot open {DB_FILE}: {e}")
+        with db_writer_lock:
+            db_writer_thread = None
+        return
+    running = True
+    while running:
+        rows = [db_write_queue.get()]
+        while len(rows) < DB_BATCH_SIZE:
+            try:
+                rows.append(db_write_queue.get_nowait())
+            except queue.Empty:
+                break
+        if DB_STOP in rows:
+            running = False
+            rows = [row for row in rows if row is not DB_STOP]
+        if rows:
+            try:
+                conn.executemany("INSERT INTO logs (plate, timestamp, type, confidence, image_path, roi_image_path, api_response) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                conn.commit()
+            except Exception as e:
+                print(f"Database error: {e}")
+    conn.close()
+
+def flush_log_rows():
+    """Stop the writer after it has written everything queued (shutdown)"""
+    if db_writer_thread is not None:
+        db_write_queue.put(DB_STOP)
+        db_writer_thread.join(timeout=5)
+
 def log_to_database(plate, vehicle_type, image_path, roi_image_path, api_response):
+    global db_writer_thread
     try:
-        conn = sqlite3.connect(os.getenv("DB_FILE", "lpr_logs.db"))
-        conn.execute('''CREATE TABLE IF NOT EXISTS logs
-                     (id INTEGER PRIMARY KEY, plate TEXT, timestamp TEXT, type TEXT, 
-                      confidence REAL, image_path TEXT, roi_image_path TEXT, api_response TEXT)''')
-        
-        conn.execute("INSERT INTO logs (plate, timestamp, type, confidence, image_path, roi_image_path, api_response) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (plate, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), vehicle_type, 98.5, image_path, roi_image_path, str(api_response)))
-        conn.commit()
-        conn.close()
+        if db_writer_thread is None:
+            with db_writer_lock:
+                if db_writer_thread is None:
+                    db_writer_thread = threading.Thread(target=db_writer, daemon=True)
+                    db_writer_thread.start()
+        db_write_queue.put((plate, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), vehicle_type, 98.5,
+                            image_path, roi_image_path,
+                            json.dumps(api_response, separators=(',', ':'), default=str)))
         print(f"✓ DETECTED: {plate} [{vehicle_type}] → Full: {image_path} | ROI: {roi_image_path}")
     except Exception as e:
         print(f"Database error: {e}")
@@ -219,11 +316,6 @@ def process_frame_for_lpr(frame):
     """
     current_time = time.time()
     
-    # Periodic cleanup (every hour)
-    if state.temp_cleanup and (current_time - state.last_cleanup_time) > 3600:
-        state.temp_cleanup.cleanup_old_files()
-        state.last_cleanup_time = current_time
-
     try:
         # Check if detectors are available
         if state.vehicle_detector is None or state.vehicle_detector.model is None:
@@ -241,25 +333,27 @@ def process_frame_for_lpr(frame):
             cv2.putText(frame, "No vehicles detected", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
             return frame
         
-        print(f"🚗 Detected {len(vehicles)} vehicles")
+        logger.debug("🚗 Detected %d vehicles", len(vehicles))
         
         # Track all detected plates across all vehicles
         all_plates = []
         
-        # STAGE 2: For each vehicle, detect plates
+        # STAGE 2: Collect vehicle ROIs, then detect plates in all of them with one batched call
+        # (ROIs are extracted before any boxes are drawn onto the frame)
+        vehicle_rois = []
+        for v_idx, (vx1, vy1, vx2, vy2, v_conf, v_cls) in enumerate(vehicles):
+            vehicle_roi = frame[vy1:vy2, vx1:vx2]
+            if vehicle_roi.size > 0:
+                vehicle_rois.append((v_idx, vx1, vy1, vehicle_roi))
+        
+        plates_per_vehicle = state.yolo_detector.detect_plates_batch([roi for _, _, _, roi in vehicle_rois])
+        
         for v_idx, (vx1, vy1, vx2, vy2, v_conf, v_cls) in enumerate(vehicles):
             # Draw vehicle bounding box (blue)
             cv2.rectangle(frame, (vx1, vy1), (vx2, vy2), (255, 0, 0), 2)
             cv2.putText(frame, f"Vehicle {v_idx+1}", (vx1, vy1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
-            
-            # Extract vehicle ROI
-            vehicle_roi = frame[vy1:vy2, vx1:vx2]
-            if vehicle_roi.size == 0:
-                continue
-            
-            # Detect plates within this vehicle ROI
-            plates_in_vehicle = state.yolo_detector.detect_plates(vehicle_roi)
-            
+        
+        for (v_idx, vx1, vy1, _), plates_in_vehicle in zip(vehicle_rois, plates_per_vehicle):
             # Convert plate coordinates from ROI to full frame
             for px1, py1, px2, py2, p_conf in plates_in_vehicle:
                 # Translate coordinates to full frame
@@ -270,7 +364,7 @@ def process_frame_for_lpr(frame):
                 
                 all_plates.append((full_x1, full_y1, full_x2, full_y2, p_conf, v_idx))
         
-        print(f"🔍 Detected {len(all_plates)} plates across vehicles")
+        logger.debug("🔍 Detected %d plates across vehicles", len(all_plates))
         
         if not all_plates:
             cv2.putText(frame, f"{len(vehicles)} vehicles, no plates", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
@@ -278,61 +372,42 @@ def process_frame_for_lpr(frame):
 
         # STAGE 3 & 4: Plate Stability Detection and Processing
         with state.state_lock:
-            # Clear old tracked plates (older than 30 seconds)
-            state.processed_vehicles = {k: v for k, v in state.processed_vehicles.items() if current_time - v.get('first_seen', 0) < 30}
+            # Clear old tracked plates (older than 30 seconds); first_seen follows insertion order
+            expire_oldest(state.processed_vehicles, lambda track: current_time - track.first_seen >= 30)
 
             for i, (x1, y1, x2, y2, yolo_confidence, vehicle_idx) in enumerate(all_plates):
                 # Create a unique identifier for this plate
                 plate_key = f"{x1//10}_{y1//10}_{x2//10}_{y2//10}_{int((x2-x1) * (y2-y1) / 100)}"
 
                 # Initialize or update plate tracking
-                if plate_key not in state.processed_vehicles:
-                    state.processed_vehicles[plate_key] = {
-                        'bbox_history': [(x1, y1, x2, y2)],
-                        'stability_count': 0,
-                        'last_seen': current_time,
-                        'first_seen': current_time,
-                        'last_processed': 0,
-                        'confidence': yolo_confidence
-                    }
-                    print(f"🆕 New plate detected: {plate_key} [Stabilizing 0/3]")
+                track = state.processed_vehicles.get(plate_key)
+                if track is None:
+                    state.processed_vehicles[plate_key] = PlateTrack((x1, y1, x2, y2), yolo_confidence, current_time)
+                    logger.debug("🆕 New plate detected: %s [Stabilizing 0/3]", plate_key)
                     cv2.putText(frame, f"P{i+1}: New", (x1, y1-20), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 165, 0), 1)
                 else:
                     # Update existing plate tracking
-                    state.processed_vehicles[plate_key]['last_seen'] = current_time
-                    state.processed_vehicles[plate_key]['bbox_history'].append((x1, y1, x2, y2))
-
-                    # Keep only last 5 positions for stability calculation
-                    if len(state.processed_vehicles[plate_key]['bbox_history']) > 5:
-                        state.processed_vehicles[plate_key]['bbox_history'] = state.processed_vehicles[plate_key]['bbox_history'][-5:]
+                    track.last_seen = current_time
+                    track.bbox_history.append((x1, y1, x2, y2))  # bounded to the last 5 positions
 
                     # Calculate stability based on position variance
-                    hist = state.processed_vehicles[plate_key]['bbox_history']
+                    hist = track.bbox_history
                     if len(hist) >= 3:
-                        # Calculate average position
-                        avg_x1 = sum([x[0] for x in hist]) / len(hist)
-                        avg_y1 = sum([x[1] for x in hist]) / len(hist)
-                        avg_x2 = sum([x[2] for x in hist]) / len(hist)
-                        avg_y2 = sum([x[3] for x in hist]) / len(hist)
-
-                        # Calculate variance
-                        var_x1 = sum([(x[0] - avg_x1)**2 for x in hist]) / len(hist)
-                        var_y1 = sum([(x[1] - avg_y1)**2 for x in hist]) / len(hist)
-                        var_x2 = sum([(x[2] - avg_x2)**2 for x in hist]) / len(hist)
-                        var_y2 = sum([(x[3] - avg_y2)**2 for x in hist]) / len(hist)
+                        # Per-coordinate position variance over the history (one vectorized pass)
+                        max_variance = float(np.var(np.asarray(hist, dtype=np.float64), axis=0).max())
 
                         # If variance is low, plate is stable
                         stability_threshold = 15.0
-                        if max(var_x1, var_y1, var_x2, var_y2) < stability_threshold:
-                            state.processed_vehicles[plate_key]['stability_count'] += 1
-                            current_stability = state.processed_vehicles[plate_key]['stability_count']
+                        if max_variance < stability_threshold:
+                            track.stability_count += 1
+                            current_stability = track.stability_count
 
-                            print(f"🔄 Plate {i+1}: Stabilizing {current_stability}/3 (variance: {max(var_x1, var_y1, var_x2, var_y2):.2f})")
+                            logger.debug("🔄 Plate %d: Stabilizing %d/3 (variance: %.2f)", i+1, current_stability, max_variance)
                             cv2.putText(frame, f"P{i+1}: Stab {current_stability}/3", (x1, y1-20), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 255), 1)
 
                             # If stable for 3 consecutive frames AND not processed recently, capture and process
                             if (current_stability >= 3 and
-                                current_time - state.processed_vehicles[plate_key]['last_processed'] >= 30):
+                                current_time - track.last_processed >= 30):
 
                                 # Extract ROI for the stable plate
                                 padding = 15
@@ -344,20 +419,15 @@ def process_frame_for_lpr(frame):
                                 plate_roi = frame[y1_roi:y2_roi, x1_roi:x2_roi].copy()
 
                                 if plate_roi.size > 0:
-                                    # STAGE 3: OpenCV Enhancement
-                                    enhanced_roi = state.image_enhancer.enhance_plate(plate_roi)
-                                    
-                                    # Check sharpness
-                                    if not state.image_enhancer.is_sharp_enough(enhanced_roi):
-                                        print(f"⚠️ Plate {i+1}: Not sharp enough, skipping")
-                                        continue
+                                    # STAGE 3: OpenCV Enhancement (skipped for crops that are already sharp)
+                                    enhanced_roi = state.image_enhancer.maybe_enhance(plate_roi)
                                     
                                     # Save enhanced ROI
                                     os.makedirs('temp_screenshots', exist_ok=True)
-                                    from datetime import timezone
-                                    timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S_%f")
-                                    screenshot_path = f"temp_screenshots/enhanced_plate_{i+1}_{timestamp}.jpg"
+                                    screenshot_path = f"temp_screenshots/enhanced_plate_{i+1}_{next_capture_id()}.jpg"
                                     cv2.imwrite(screenshot_path, enhanced_roi)
+                                    if state.temp_cleanup:
+                                        state.temp_cleanup.schedule_file(screenshot_path)
                                     print(f"📸 Stable plate {i+1} captured & enhanced! Saved: {screenshot_path}")
                                     cv2.putText(frame, f"P{i+1}: CAPTURED", (x1, y1-20), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 0), 1)
 
@@ -371,21 +441,23 @@ def process_frame_for_lpr(frame):
                                         'vehicle_index': vehicle_idx
                                     }
 
-                                    state.vehicle_queue.put(vehicle_data)
+                                    enqueue_vehicle(vehicle_data)
                                     print(f"📤 Queued for OCR: {screenshot_path} (Conf: {yolo_confidence:.3f})")
 
                                     # Update last processed time
-                                    state.processed_vehicles[plate_key]['last_processed'] = current_time
-                                    state.processed_vehicles[plate_key]['stability_count'] = 0
-
-                                    # Start queue processor if not running
-                                    if not state.api_busy:
-                                        threading.Thread(target=process_vehicle_queue, daemon=True).start()
+                                    track.last_processed = current_time
+                                    track.stability_count = 0
+
+                                    # Start the single OCR consumer if not running (it blocks on the queue)
+                                    if not state.ocr_worker_running:
+                                        state.ocr_worker_thread = threading.Thread(target=async_api_processor, daemon=True)
+                                        state.ocr_worker_thread.start()
+                                        state.ocr_worker_running = True
                                         print("📡 OCR processing thread started")
                         else:
                             # Reset stability if plate moved too much
-                            state.processed_vehicles[plate_key]['stability_count'] = max(0, state.processed_vehicles[plate_key]['stability_count'] - 1)
-                            print(f"🚗 Plate {i+1}: Unstable (variance: {max(var_x1, var_y1, var_x2, var_y2):.2f})")
+                            track.stability_count = max(0, track.stability_count - 1)
+                            logger.debug("🚗 Plate %d: Unstable (variance: %.2f)", i+1, max_variance)
                             cv2.putText(frame, f"P{i+1}: Moving", (x1, y1-20), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 255), 1)
                     else:
                         cv2.putText(frame, f"P{i+1}: Tracking", (x1, y1-20), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 0), 1)
@@ -460,6 +532,8 @@ def process_single_plate(frame, x1, y1, x2, y2, yolo_confidence, current_time, p
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         screenshot_path = f"temp_screenshots/vehicle_{plate_index}_{timestamp}.jpg"
         cv2.imwrite(screenshot_path, plate_roi)
+        if state.temp_cleanup:
+            state.temp_cleanup.schedule_file(screenshot_path)
         
         # Add to queue
         process_single_plate.api_queue.put({
@@ -486,9 +560,61 @@ def process_single_plate(frame, x1, y1, x2, y2, yolo_confidence, current_time, p
         print(f"Error processing plate {plate_index}: {e}")
         return False
 
+@functools.lru_cache(maxsize=64)
+def camera_direction(camera_name):
+    """Gate direction from a camera name such as RAHQ-G1-IN-01 (computed once per camera)"""
+    return "IN" if "IN" in camera_name else "OUT" if "OUT" in camera_name else "UNKNOWN"
+
+# Capture ids: UTC second prefix (formatted once per second) + process-local counter.
+# Time-ordered and unique even for captures in the same microsecond.
+capture_counter = itertools.count()
+capture_prefix = (0, "")
+
+def next_capture_id():
+    """Unique id for a capture file, e.g. 20250101_120000_000042"""
+    global capture_prefix
+    now = int(time.time())
+    second, prefix = capture_prefix
+    if now != second:
+        prefix = time.strftime("%Y%m%d_%H%M%S", time.gmtime(now))
+        capture_prefix = (now, prefix)
+    return f"{prefix}_{next(capture_counter):06d}"
+
+def expire_oldest(entries, is_expired):
+    """Pop expired entries from the front of a dict kept in timestamp (insertion) order.
+    Stops at the first live entry, so the cost is the number expired rather than the dict size."""
+    while entries:
+        oldest_key = next(iter(entries))
+        if not is_expired(entries[oldest_key]):
+            break
+        del entries[oldest_key]
+
+def remove_file(path):
+    """Delete a temp file; returns False if it was already gone (no exists() pre-check)"""
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def enqueue_vehicle(vehicle_data):
+    """Queue a plate for OCR without blocking; when full, drop the oldest pending plate"""
+    while True:
+        try:
+            state.vehicle_queue.put_nowait(vehicle_data)
+            return
+        except queue.Full:
+            try:
+                dropped = state.vehicle_queue.get_nowait()
+            except queue.Empty:
+                continue
+            dropped_path = dropped.get('screenshot_path')
+            print(f"⚠️ OCR queue full ({OCR_QUEUE_SIZE}), dropping oldest: {dropped_path}")
+            if dropped_path:
+                remove_file(dropped_path)
+
 def async_api_processor():
     """Process API calls asynchronously for multiple vehicles"""
-    import requests
     global processed_vehicles, processed_plates  # Declare globals at the beginning
 
     # Initialize processed hashes for MD5 duplicate detection
@@ -496,15 +622,13 @@ def async_api_processor():
 
     while True:
         try:
-            if state.vehicle_queue.empty():
-                time.sleep(0.1)
-                continue
-
-            vehicle_data = state.vehicle_queue.get(timeout=1)
+            # Block until work arrives instead of polling empty() + sleep
+            vehicle_data = state.vehicle_queue.get()
 
             # Calculate MD5 hash of the image to prevent duplicate processing
             screenshot_path = vehicle_data['screenshot_path']
             image_hash = None
+            file_content = None
             try:
                 with open(screenshot_path, 'rb') as f:
                     file_content = f.read()
@@ -513,14 +637,12 @@ def async_api_processor():
                 # Check if this image hash has been processed recently to avoid duplicates
                 # Clean old hashes (older than 30 seconds)
                 current_time = time.time()
-                processed_hashes = {k: v for k, v in processed_hashes.items()
-                                  if current_time - v['timestamp'] < 30}
+                expire_oldest(processed_hashes, lambda v: current_time - v['timestamp'] >= 30)
 
                 if image_hash in processed_hashes:
                     print(f"⏭️ Skipping duplicate image (hash: {image_hash[:8]}...) - processed recently")
                     # Clean up the duplicate image file
-                    if os.path.exists(screenshot_path):
-                        os.remove(screenshot_path)
+                    if remove_file(screenshot_path):
                         print(f"🗑️ Deleted duplicate temp image: {screenshot_path}")
                     continue  # Skip this duplicate image
             except Exception as e:
@@ -530,15 +652,17 @@ def async_api_processor():
             # Mark this hash as processed
             if image_hash:
                 processed_hashes[image_hash] = {
-                    'timestamp': time.time(),
+                    'timestamp': current_time,
                     'bbox': vehicle_data['bbox']
                 }
 
-            # Make API call
-            with open(screenshot_path, 'rb') as f:
-                files = {'image': ('roi.jpg', f, 'image/jpeg')}
-                response = requests.post(f"http://localhost:{API_PORT}/extract-license-plate",
-                                       files=files, timeout=20)
+            # Make API call (reuse the bytes already read for hashing)
+            if file_content is None:
+                with open(screenshot_path, 'rb') as f:
+                    file_content = f.read()
+            files = {'image': ('roi.jpg', file_content, 'image/jpeg')}
+            response = api_session.post(f"http://localhost:{API_PORT}/extract-license-plate",
+                                   files=files, timeout=20)
 
             if response.status_code == 200:
                 result = response.json()
@@ -552,28 +676,24 @@ def async_api_processor():
                         if time_since_last < state.duplicate_cooldown:
                             print(f"⏭️ Duplicate: {plate} (seen {time_since_last:.1f}s ago, cooldown: {state.duplicate_cooldown}s)")
                             # Clean up duplicate image
-                            if os.path.exists(screenshot_path):
-                                os.remove(screenshot_path)
+                            remove_file(screenshot_path)
                             continue
                     
-                    # Update recent plates tracker
+                    # Update recent plates tracker (re-insert so the dict stays ordered by last seen)
+                    state.recent_plates.pop(plate, None)
                     state.recent_plates[plate] = current_time
                     
                     # Clean old entries (older than 60 seconds)
-                    state.recent_plates = {k: v for k, v in state.recent_plates.items() 
-                                          if current_time - v < 60}
+                    expire_oldest(state.recent_plates, lambda v: current_time - v >= 60)
                     
                     print(f"✅ NEW DETECTION: {plate} [Vehicle {vehicle_data.get('plate_index', 0)+1}]")
                     
                     # MONGODB WRITE: Save to persistent storage
                     if state.mongodb_sync and state.mongodb_sync.is_enabled():
                         try:
-                            from utils.camera_config import get_active_camera
-                            active_camera = get_active_camera()
+                            active_camera = get_active_camera() if get_active_camera else None
                             camera_name = active_camera.name if active_camera else "API_Upload"
-                            
-                            # Determine direction from camera name
-                            direction = "IN" if "IN" in camera_name else "OUT" if "OUT" in camera_name else "UNKNOWN"
+                            direction = camera_direction(camera_name)
                             
                             record = {
                                 'plate': plate,
@@ -590,19 +710,15 @@ def async_api_processor():
                             print(f"⚠️ MongoDB sync failed: {e}")
 
             # Cleanup - delete the image file after processing
-            if os.path.exists(screenshot_path):
-                os.remove(screenshot_path)
+            if remove_file(screenshot_path):
                 print(f"🗑️ Deleted temp image after processing: {screenshot_path}")
 
-        except queue.Empty:
-            continue
         except Exception as e:
             print(f"API processor error: {e}")
             # Even if there's an error, try to clean up the image file
             try:
                 screenshot_path = vehicle_data.get('screenshot_path')
-                if screenshot_path and os.path.exists(screenshot_path):
-                    os.remove(screenshot_path)
+                if screenshot_path and remove_file(screenshot_path):
                     print(f"🗑️ Deleted temp image after error: {screenshot_path}")
             except:
                 pass
@@ -665,7 +781,7 @@ def get_shared_camera():
             # Try RTSP first, fallback to webcam
             if RTSP_URL:
                 print(f"🔗 Trying RTSP: {RTSP_URL}")
-                camera_instance = cv2.VideoCapture(RTSP_URL)
+                camera_instance = cv2.VideoCapture(RTSP_URL, cv2.CAP_FFMPEG)
                 if not camera_instance.isOpened():
                     print(f"❌ RTSP connection failed: {RTSP_URL}")
                     camera_instance = None
@@ -717,6 +833,8 @@ def get_latest_frame():
 
 # OPTIMIZED LOW-LATENCY MJPEG STREAM
 def generate_frames():
+    processed_frame_time = None  # capture time of the frame last sent through the detectors
+    annotated_bytes = None
     while True:
         success, frame = get_latest_frame()
         if not success or frame is None:
@@ -731,21 +849,26 @@ def generate_frames():
             time.sleep(0.05)
             continue
         
-        # Process frame for license plate detection
-        frame = process_frame_for_lpr(frame)
-        
-        # Add timestamp overlay
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cv2.putText(frame, timestamp, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-        
-        # OPTIMIZATION 1: Resize to 640x360 (4x smaller)
-        small_frame = cv2.resize(frame, (640, 360))
-        
-        # OPTIMIZATION 2: Fast JPEG quality (60 instead of 80)
-        ret, buffer = cv2.imencode('.jpg', small_frame, [cv2.IMWRITE_JPEG_QUALITY, 60])
-        frame_bytes = buffer.tobytes()
+        # Only forward new camera frames to the detectors; while get_latest_frame()
+        # is serving its cached frame, re-send the last annotated JPEG instead
+        if annotated_bytes is None or last_frame_time != processed_frame_time:
+            processed_frame_time = last_frame_time
+            
+            # Process frame for license plate detection (on a copy, the cached frame stays clean)
+            frame = process_frame_for_lpr(frame.copy())
+            
+            # Add timestamp overlay
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            cv2.putText(frame, timestamp, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+            
+            # OPTIMIZATION 1: Resize to 640x360 (4x smaller)
+            small_frame = cv2.resize(frame, (640, 360))
+            
+            # OPTIMIZATION 2: Fast JPEG quality (60 instead of 80)
+            ret, buffer = cv2.imencode('.jpg', small_frame, [cv2.IMWRITE_JPEG_QUALITY, 60])
+            annotated_bytes = buffer.tobytes()
         yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+               b'Content-Type: image/jpeg\r\n\r\n' + annotated_bytes + b'\r\n')
         
         # OPTIMIZATION 3: 10 FPS for better performance
         time.sleep(0.1)
@@ -863,6 +986,10 @@ def stop_headless_service():
     # Stop LlamaServer if running
     if state.license_plate_service and hasattr(state.license_plate_service, 'shutdown'):
         state.license_plate_service.shutdown()
+    
+    # Write out records still queued for MongoDB
+    if state.mongodb_sync:
+        state.mongodb_sync.close()
         
     print("✅ Services stopped")
 
@@ -876,6 +1003,7 @@ if __name__ == "__main__":
     # Register cleanup handlers
     signal.signal(signal.SIGINT, signal_handler)
     atexit.register(stop_headless_service)
+    atexit.register(flush_log_rows)
     
     print("🚀 Starting Complete LPR System...")
     print(f"📡 API Server: http://localhost:{API_PORT}")
@@ -2,11 +2,14 @@
 import os
 import time
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime
 from pathlib import Path
 import cv2
 import numpy as np
 import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,8 +19,22 @@ CAM_IP = os.getenv("CAMERA_IP")
 CAM_USER = os.getenv("CAMERA_USERNAME")
 CAM_PASS = os.getenv("CAMERA_PASSWORD")
 RTSP_URL = os.getenv("RTSP_URL")
+RTSP_TRANSPORT = os.getenv("RTSP_TRANSPORT", "tcp")  # tcp or udp (low-latency LAN)
 API_URL = f"http://localhost:{os.getenv('API_PORT',8000)}/extract-license-plate"
 GATE_PIN = int(os.getenv("GATE_PIN", 17))
+MOTION_ROI = (300, 600, 800, 300)  # x, y, w, h
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", 2))
+CAMERA_RETRY_MAX = 60  # seconds between primary-camera retries while on a fallback
+
+# FFmpeg capture options, computed once and picked up by every (re)connect
+os.environ.setdefault(
+    "OPENCV_FFMPEG_CAPTURE_OPTIONS",
+    f"rtsp_transport;{RTSP_TRANSPORT}|buffer_size;1024000|max_delay;500000|stimeout;5000000"
+)
+
+# Keep-alive session shared by all API uploads (one connection per send worker)
+api_session = requests.Session()
+api_session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=SEND_WORKERS))
 
 SNAPSHOT_DIR = Path("snapshots")
 LOG_FILE = Path("lpr.log")
@@ -46,46 +63,140 @@ class DummyVideoCapture:
         time.sleep(0.1) # Simulate 10 FPS
         return True, self.frame.copy()
     
+    def grab(self):
+        time.sleep(0.1) # Simulate 10 FPS
+        return True
+    
+    def retrieve(self):
+        return True, self.frame.copy()
+    
     def release(self):
         pass
 
-def capture_frame():
-    # Handle empty RTSP_URL by falling back to webcam 0
-    source = RTSP_URL
-    cap = None
-    
-    if source:
-        cap = cv2.VideoCapture(source)
-        if not cap.isOpened():
-            cap = None
-            
-    if cap is None:
+def open_primary_capture():
+    """The configured camera (RTSP_URL, or webcam 0 when it is empty); None if unavailable"""
+    if RTSP_URL:
+        cap = cv2.VideoCapture(RTSP_URL, cv2.CAP_FFMPEG)
+    else:
+        cap = cv2.VideoCapture(0)
+    if cap.isOpened():
+        return cap
+    cap.release()
+    return None
+
+def open_capture():
+    """Returns (capture, is_primary); falls back to webcam 0, then the dummy feed"""
+    cap = open_primary_capture()
+    if cap is not None:
+        return cap, True
+    
+    if RTSP_URL:
         # Try webcam
         cap = cv2.VideoCapture(0)
-        if not cap.isOpened():
-            cap = None
+        if cap.isOpened():
+            return cap, False
+        cap.release()
+    
+    # Fallback to dummy
+    return DummyVideoCapture(), False
+
+class FrameGrabber:
+    """
+    Keeps a single capture open and drains it on a background thread with grab(),
+    so the stream never backs up; only frames we actually use are decoded (retrieve()).
+    All capture calls happen on the grab thread. While on a fallback (webcam / dummy)
+    the primary camera is retried with backoff, so an RTSP outage recovers on its own.
+    """
+    def __init__(self):
+        self.cap = None
+        self.on_fallback = False
+        self.next_retry = 0.0
+        self.retry_delay = 2.0
+        self.latest = None
+        self.frame_requested = threading.Event()
+        self.frame_ready = threading.Event()
+        self.running = False
+        self.thread = None
+    
+    def _open(self):
+        self.cap, is_primary = open_capture()
+        self.on_fallback = not is_primary
+        if self.on_fallback:
+            log("Primary camera unavailable, using fallback")
+            self.retry_delay = 2.0
+            self.next_retry = time.monotonic() + self.retry_delay
+    
+    def _retry_primary(self):
+        """Switch back to the primary camera if it can be opened again (with backoff)"""
+        cap = open_primary_capture()
+        if cap is None:
+            self.retry_delay = min(self.retry_delay * 2, CAMERA_RETRY_MAX)
+            self.next_retry = time.monotonic() + self.retry_delay
+            return
+        log("Primary camera reconnected")
+        self.cap.release()
+        self.cap = cap
+        self.on_fallback = False
+    
+    def start(self):
+        self._open()
+        self.running = True
+        self.thread = threading.Thread(target=self._grab_loop, daemon=True)
+        self.thread.start()
+    
+    def _grab_loop(self):
+        while self.running:
+            if self.on_fallback and time.monotonic() >= self.next_retry:
+                self._retry_primary()
+            
+            if not self.cap.grab():
+                # Stream dropped - reconnect
+                log("Camera grab failed, reconnecting...")
+                self.cap.release()
+                time.sleep(1)
+                self._open()
+                continue
             
-    if cap is None:
-        # Fallback to dummy
-        cap = DummyVideoCapture()
+            # Decode only when the main loop asked for a frame
+            if self.frame_requested.is_set():
+                ret, frame = self.cap.retrieve()
+                self.latest = frame if ret else None
+                self.frame_requested.clear()
+                self.frame_ready.set()
+    
+    def read(self, timeout=2.0):
+        """Return the next grabbed frame, decoded, or None on timeout"""
+        self.frame_ready.clear()
+        self.frame_requested.set()
+        if not self.frame_ready.wait(timeout):
+            return None
+        return self.latest
+    
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+        if self.cap:
+            self.cap.release()
 
-    if not cap.isOpened():
-        return None
-    ret, frame = cap.read()
-    cap.release()
-    return frame if ret else None
+grabber = FrameGrabber()
+
+def capture_frame():
+    if not grabber.running:
+        grabber.start()
+    return grabber.read()
 
 def send_to_api(image_bytes):
     try:
         files = {'image': ('plate.jpg', image_bytes, 'image/jpeg')}
-        r = requests.post(API_URL, files=files, timeout=30)
+        r = api_session.post(API_URL, files=files, timeout=30)
         if r.status_code == 200:
             return r.json()
         log(f"API error {r.status_code}")
         # Fallback to local API at localhost:8000
         try:
             local_api_url = "http://0.0.0.0:8000/extract-license-plate"
-            local_response = requests.post(local_api_url, files=files, timeout=30)
+            local_response = api_session.post(local_api_url, files=files, timeout=30)
             if local_response.status_code == 200:
                 return local_response.json()
             else:
@@ -98,7 +209,7 @@ def send_to_api(image_bytes):
         try:
             local_api_url = "http://0.0.0.0:8000/extract-license-plate"
             files = {'image': ('plate.jpg', image_bytes, 'image/jpeg')}
-            local_response = requests.post(local_api_url, files=files, timeout=30)
+            local_response = api_session.post(local_api_url, files=files, timeout=30)
             if local_response.status_code == 200:
                 return local_response.json()
             else:
@@ -109,25 +220,68 @@ def send_to_api(image_bytes):
 
 
 
-def detect_motion(frame1, frame2):
-    if frame1 is None or frame2 is None:
-        return False
-    
-    gray1 = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
-    gray2 = cv2.cvtColor(frame2, cv2.COLOR_BGR2GRAY)
-    diff = cv2.absdiff(gray1, gray2)
-    
+def roi_gray(frame):
+    # Crop to the motion ROI *before* grayscale conversion so only ROI pixels are touched
+    x, y, w, h = MOTION_ROI
+    roi = frame[y:y+h, x:x+w]
+    if roi.size == 0:
+        return None
+    return cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+
+def motion_score(gray1, gray2):
+    # Takes ROI grays from roi_gray() so each frame is converted only once
+    if gray1 is None or gray2 is None:
+        return 0.0
+    return cv2.mean(cv2.absdiff(gray1, gray2))[0]
+
+def detect_motion(gray1, gray2):
     # Motion in ROI area
-    x, y, w, h = 300, 600, 800, 300
-    roi_diff = diff[y:y+h, x:x+w]
-    motion_score = cv2.mean(roi_diff)[0]
-    
-    return motion_score > 15
+    return motion_score(gray1, gray2) > 15
+
+def encode_and_send(frame, snapshot_path, stable_frames):
+    """Encode a captured frame once, save the snapshot, send it to the API and clean up"""
+    try:
+        # Encode image (the same JPEG bytes are used for the snapshot and the API)
+        ret, buffer = cv2.imencode('.jpg', frame)
+        if not ret:
+            log("Failed to encode image")
+            return
+        image_bytes = buffer.tobytes()
+        
+        # Save snapshot
+        snapshot_path.write_bytes(image_bytes)
+        log(f"Snapshot saved: {snapshot_path.name} (stable frames: {stable_frames})")
+        
+        # Send to API
+        result = send_to_api(image_bytes)
+        plate = result.get("registrationNo", "")
+        if plate:
+            plate = plate.upper()
+        else:
+            plate = ""
+        
+        # Delete image after API processing
+        try:
+            if snapshot_path.exists():
+                snapshot_path.unlink()
+                log(f"✅ Deleted temp image: {snapshot_path.name}")
+        except Exception as e:
+            log(f"❌ Failed to delete temp image: {e}")
+        
+        if plate and len(plate) >= 6:
+            log(f"PLATE DETECTED: {plate}")
+        else:
+            log("No valid plate detected")
+    except Exception as e:
+        log(f"Send error: {e}")
 
 def main():
     log("LPR Headless Service STARTED")
     
-    prev_frame = None
+    # Encoding and HTTP happen off the capture loop
+    send_pool = ThreadPoolExecutor(max_workers=SEND_WORKERS)
+    
+    prev_gray = None  # ROI grayscale of the previous frame
     last_detection = 0
     processed_hashes = set()  # Track MD5 hashes of processed images
     max_hash_history = 100   # Keep last 100 hashes to prevent memory buildup
@@ -139,14 +293,15 @@ def main():
             if frame is None:
                 time.sleep(1)
                 continue
+            gray = roi_gray(frame)
             
             # Motion detection
-            if detect_motion(prev_frame, frame):
+            if detect_motion(prev_gray, gray):
                 current_time = time.time()
                 
                 # Rate limiting (15 seconds to allow vehicle to pass completely)
                 if current_time - last_detection < 15:
-                    prev_frame = frame
+                    prev_gray = gray
                     continue
                 
                 log("MOTION DETECTED")
@@ -161,19 +316,12 @@ def main():
                     new_frame = capture_frame()
                     if new_frame is None:
                         break
+                    new_gray = roi_gray(new_frame)
                     
                     # Check if new frame is stable compared to current frame
-                    if prev_frame is not None:
-                        gray1 = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-                        gray2 = cv2.cvtColor(new_frame, cv2.COLOR_BGR2GRAY)
-                        diff = cv2.absdiff(gray1, gray2)
-                        
+                    if prev_gray is not None:
                         # Check motion in same ROI
-                        x, y, w, h = 300, 600, 800, 300
-                        roi_diff = diff[y:y+h, x:x+w]
-                        motion_score = cv2.mean(roi_diff)[0]
-                        
-                        if motion_score < 10:  # Low motion = stable
+                        if motion_score(prev_gray, new_gray) < 10:  # Low motion = stable
                             stable_frames += 1
                             last_stable_frame = new_frame.copy()
                             if stable_frames >= stable_threshold:
@@ -181,7 +329,7 @@ def main():
                         else:
                             stable_frames = 0
                     
-                    prev_frame = new_frame
+                    prev_gray = new_gray
                 
                 # Use the best stable frame for capture
                 capture_frame_to_use = last_stable_frame if last_stable_frame is not None else frame
@@ -192,7 +340,7 @@ def main():
                 # Check if this image has already been processed
                 if frame_hash in processed_hashes:
                     log(f"Duplicate image detected (hash: {frame_hash[:8]}...), skipping")
-                    prev_frame = frame
+                    prev_gray = gray
                     continue
                 
                 # Add hash to processed set
@@ -207,39 +355,14 @@ def main():
                 
                 log(f"New image detected (hash: {frame_hash[:8]}...)")
                 
-                # Save snapshot
+                # Encode + snapshot + API call run on the send pool so capture keeps going
                 ts = datetime.now().strftime("%Y%m%d_%H%M%S")
                 snapshot_path = SNAPSHOT_DIR / f"vehicle_{ts}.jpg"
-                cv2.imwrite(str(snapshot_path), capture_frame_to_use)
-                log(f"Snapshot saved: {snapshot_path.name} (stable frames: {stable_frames})")
-                
-                # Encode image
-                ret, buffer = cv2.imencode('.jpg', capture_frame_to_use)
-                if ret:
-                    # Send to API
-                    result = send_to_api(buffer.tobytes())
-                    plate = result.get("registrationNo", "")
-                    if plate:
-                        plate = plate.upper()
-                    else:
-                        plate = ""
-                    
-                    # Delete image after API processing
-                    try:
-                        if snapshot_path.exists():
-                            snapshot_path.unlink()
-                            log(f"✅ Deleted temp image: {snapshot_path.name}")
-                    except Exception as e:
-                        log(f"❌ Failed to delete temp image: {e}")
-                    
-                    if plate and len(plate) >= 6:
-                        log(f"PLATE DETECTED: {plate}")
-                    else:
-                        log("No valid plate detected")
+                send_pool.submit(encode_and_send, capture_frame_to_use, snapshot_path, stable_frames)
                 
                 last_detection = current_time
             
-            prev_frame = frame
+            prev_gray = gray
             time.sleep(0.1)
             
         except KeyboardInterrupt:
@@ -249,6 +372,8 @@ def main():
             log(f"Error: {e}")
             time.sleep(1)
     
+    send_pool.shutdown(wait=True, cancel_futures=True)
+    grabber.stop()
     log("Service stopped")
 
 if __name__ == "__main__":
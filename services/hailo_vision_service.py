@@ -7,9 +7,11 @@ This will be activated once Hailo hardware is detected.
 """
 
 import os
+import atexit
 import base64
-import hashlib
 import sys
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -28,9 +30,10 @@ except ImportError:
 # Default prompt
 DEFAULT_PROMPT = "Read the Indian license plate number from this image and return it in uppercase without any extra text."
 
-# Simple in‑memory cache
-_image_cache = {}
+# Simple in‑memory cache (key: (path, mtime_ns, size))
+_image_cache = OrderedDict()  # LRU: most recently used at the end
 _CACHE_MAX_SIZE = 100
+_cache_lock = threading.Lock()
 
 class HailoVLMInference:
     """Hailo-accelerated VLM inference"""
@@ -93,41 +96,66 @@ class HailoVLMInference:
         
         # TODO: Implement actual VLM inference
         # This is a placeholder - actual implementation depends on the specific VLM model
+        # When implemented, keep transfers overlapped with compute:
+        # - create InferVStreams and the vstream params once (in _load_model), not per call
+        # - reuse preallocated C-contiguous numpy input buffers
+        # - feed inputs from a bounded queue (maxsize=2) on one thread and drain outputs on
+        #   another, so upload, NPU compute and readback of consecutive plates overlap;
+        #   infer() then just submits and waits on an Event
         # For now, return a placeholder
         return "HAILO_INFERENCE_PLACEHOLDER"
     
-    def __del__(self):
-        """Cleanup"""
+    def release(self):
+        """Release the Hailo device"""
         if self.device:
             self.device.release()
+            self.device = None
+
+
+# One inference context per process: device scan + HEF load happen once, not per image
+_hailo_instance = None
+_hailo_lock = threading.Lock()
+
+def _get_hailo() -> HailoVLMInference:
+    """Create the shared HailoVLMInference on first use"""
+    global _hailo_instance
+    if _hailo_instance is None:
+        with _hailo_lock:
+            if _hailo_instance is None:
+                _hailo_instance = HailoVLMInference()
+                atexit.register(_hailo_instance.release)
+    return _hailo_instance
 
 
 def run_vision_llm_hailo(image_path: str, prompt: str = DEFAULT_PROMPT) -> str:
     """Run VLM inference using Hailo acceleration"""
     
-    # Check cache first
+    # Check cache first; path + mtime + size identify the image without reading or hashing it
     try:
-        with open(image_path, "rb") as f:
-            img_bytes = f.read()
+        st = os.stat(image_path)
     except FileNotFoundError:
         print(f"Error: Image file not found at {image_path}")
         return ""
     
-    cache_key = hashlib.sha256(img_bytes).hexdigest()
-    if cache_key in _image_cache:
-        return _image_cache[cache_key]
+    cache_key = (image_path, st.st_mtime_ns, st.st_size)
+    with _cache_lock:
+        if cache_key in _image_cache:
+            _image_cache.move_to_end(cache_key)
+            return _image_cache[cache_key]
     
     try:
-        # Initialize Hailo inference
-        hailo_vlm = HailoVLMInference()
+        # Shared Hailo inference context
+        hailo_vlm = _get_hailo()
         
         # Run inference
         result = hailo_vlm.infer(image_path, prompt)
         
-        # Cache result
-        if len(_image_cache) >= _CACHE_MAX_SIZE:
-            _image_cache.pop(next(iter(_image_cache)))
-        _image_cache[cache_key] = result
+        # Cache result (evict least recently used)
+        with _cache_lock:
+            _image_cache[cache_key] = result
+            _image_cache.move_to_end(cache_key)
+            if len(_image_cache) > _CACHE_MAX_SIZE:
+                _image_cache.popitem(last=False)
         
         return result
     
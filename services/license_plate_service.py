@@ -1,13 +1,35 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import logging
 import os
-import base64
+import binascii
+import hashlib
+import re
 from dotenv import load_dotenv
 from utils.indian_number_plates_guide import validate_license_plate
 from utils.internet_checker import check_internet_connection
 import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Fast JSON (de)serialization when installed; json_dumps always returns bytes and
+# orjson.loads raises a ValueError subclass, like json.loads
+try:
+    from orjson import loads as json_loads, dumps as json_dumps
+except ImportError:
+    json_loads = json.loads
+    
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+# Fast non-cryptographic hash for cache keys when installed, BLAKE2b otherwise
+try:
+    from xxhash import xxh3_64_hexdigest as _image_digest
+except ImportError:
+    def _image_digest(data):
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
 
 # Load environment variables
 load_dotenv()
@@ -21,11 +43,46 @@ OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 MODEL_NAME = os.getenv("MODEL_NAME", "qwen2.5vl:3b")
 REMOTE_API_URL = os.getenv("REMOTE_API_URL", "http://rnd.readyassist.net:8000/analyze/extract-license-plate")
 
+# Prompt for local OCR (no per-line indentation, so no wasted whitespace tokens)
+OCR_PROMPT = ("Extract the Indian vehicle license plate number from the image.\n"
+              "Return only the license plate number in the format XX00XX0000.\n"
+              "If multiple plates are visible, return the most prominent one.\n"
+              "If no license plate is found, return 'NOT_FOUND'.")
+
+# Lookup tables built once (not as list literals on every call)
+ERROR_RESULTS = frozenset({'ERROR_PROCESSING', 'PROCESSING_ERROR'})
+FAILED_RESULTS = ERROR_RESULTS | {'NOT_FOUND'}
+NO_PLATE_RESULTS = FAILED_RESULTS | {''}
+INVALID_PLATE_TYPES = frozenset({'invalid', 'invalid_state', 'invalid_bh_letters'})
+
 class LicensePlateService:
     # Cache for recent results to avoid reprocessing
-    _result_cache = {}
+    # Ordered by insertion time, so expired entries are always at the front
+    _result_cache = OrderedDict()
     _cache_lock = threading.Lock()
     _cache_ttl = 30  # Cache results for 30 seconds
+    _cache_max_size = 1024  # Upper bound on cached results
+    
+    # Futures for extractions currently running, by cache key (guarded by _cache_lock)
+    _inflight = {}
+    
+    # Base64 encodings of recent images by cache key (LRU), shared by retries and fallbacks
+    _b64_cache = OrderedDict()
+    _b64_cache_max_size = 64
+    
+    # Keep-alive connection pools shared by all instances (local Ollama and remote API)
+    _session = requests.Session()
+    _session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    _session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    
+    # A complete standard or BH-series plate (spaces removed, upper case)
+    _COMPLETE_PLATE_RE = re.compile(r'[A-Z]{2}\d{2}[A-Z]{1,3}\d{4}|\d{2}BH\d{4}[A-Z]{2}')
+    
+    # Labels the model sometimes puts around the plate text
+    _LABEL_RE = re.compile(r'(?:License Plate|Plate|Registration Number):')
+    
+    # Worker threads for extract_with_comparison (one per engine)
+    _comparison_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ocr-compare")
     
     def __init__(self, ollama_host=None, compare_engines=False):
         """
@@ -40,6 +97,25 @@ class LicensePlateService:
         self.remote_api_url = REMOTE_API_URL
         self.compare_engines = compare_engines or os.getenv("COMPARE_ENGINES", "false").lower() == "true"
         
+        # Ollama chat request template, built once; _extract_with_local_api only adds the image
+        self._ollama_message = {"role": "user", "content": OCR_PROMPT}
+        self._ollama_payload = {
+            "model": self.model_name,
+            "stream": True,  # Streamed so the reply can be cut off once a plate is complete
+            "options": {
+                "temperature": 0.1,   # Low temperature for consistent results
+                "num_ctx": 256,       # Further reduce context size to save memory
+                "num_predict": 16,    # Limit prediction length
+                "low_vram": True,     # Enable low VRAM mode
+                "repeat_penalty": 1.2, # Reduce repetition
+                "top_k": 20,          # Limit vocabulary
+                "top_p": 0.9,         # Nucleus sampling
+                "mirostat": 1,        # Use Mirostat sampling
+                "mirostat_tau": 5.0,  # Mirostat tau parameter
+                "mirostat_eta": 0.1   # Mirostat eta parameter
+            }
+        }
+        
         # Initialize LlamaCPP service
         try:
             from services.llamacpp_service import LlamaCPPService
@@ -50,8 +126,7 @@ class LicensePlateService:
     
     def _get_cache_key(self, image_bytes):
         """Generate cache key from image bytes"""
-        import hashlib
-        return hashlib.md5(image_bytes).hexdigest()
+        return _image_digest(image_bytes)
     
     def _get_cached_result(self, cache_key):
         """Get result from cache if available and not expired"""
@@ -67,8 +142,34 @@ class LicensePlateService:
     
     def _set_cached_result(self, cache_key, result):
         """Store result in cache"""
+        now = time.time()
+        with self._cache_lock:
+            cache = self._result_cache
+            cache.pop(cache_key, None)
+            cache[cache_key] = (result, now)
+            # Sweep expired entries from the front, then enforce the size cap
+            while cache:
+                _, (_, timestamp) = next(iter(cache.items()))
+                if now - timestamp < self._cache_ttl and len(cache) <= self._cache_max_size:
+                    break
+                cache.popitem(last=False)
+    
+    def _encode_image(self, image_bytes, cache_key=None):
+        """Base64 of the image, memoized so fallbacks and engine comparisons encode it once"""
+        if cache_key is None:
+            cache_key = self._get_cache_key(image_bytes)
+        with self._cache_lock:
+            image_data = self._b64_cache.get(cache_key)
+            if image_data is not None:
+                self._b64_cache.move_to_end(cache_key)
+                return image_data
+        # b2a_base64 skips base64.b64encode's wrapper
+        image_data = binascii.b2a_base64(image_bytes, newline=False).decode('ascii')
         with self._cache_lock:
-            self._result_cache[cache_key] = (result, time.time())
+            self._b64_cache[cache_key] = image_data
+            if len(self._b64_cache) > self._b64_cache_max_size:
+                self._b64_cache.popitem(last=False)
+        return image_data
     
     def extract_license_plate_from_bytes(self, image_bytes):
         """
@@ -87,6 +188,31 @@ class LicensePlateService:
             logger.info("Using cached result")
             return cached_result
         
+        # Single-flight: concurrent requests for the same image share one model call
+        with self._cache_lock:
+            future = self._inflight.get(cache_key)
+            is_owner = future is None
+            if is_owner:
+                future = self._inflight[cache_key] = Future()
+        if not is_owner:
+            logger.info("Waiting for in-flight request for the same image")
+            return future.result()
+        
+        try:
+            result = self._extract_uncached(image_bytes, cache_key)
+            # Cache the result before releasing waiters, so later callers hit the cache
+            self._set_cached_result(cache_key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._cache_lock:
+                del self._inflight[cache_key]
+    
+    def _extract_uncached(self, image_bytes, cache_key):
+        """Run the remote/local extraction for an image that is not cached"""
         # Check internet connectivity
         internet_available = check_internet_connection()
         
@@ -94,14 +220,12 @@ class LicensePlateService:
         if self.remote_api_url and self.remote_api_url.strip() != "" and internet_available:
             result = self._extract_with_remote_api(image_bytes)
             # If remote API fails, fallback to local API
-            if result in ["ERROR_PROCESSING", "PROCESSING_ERROR"] or (isinstance(result, dict) and not result.get('plate')):
-                result = self._extract_with_local_api(image_bytes)
+            if (isinstance(result, str) and result in ERROR_RESULTS) or (isinstance(result, dict) and not result.get('plate')):
+                result = self._extract_with_local_api(image_bytes, cache_key)
         else:
             # Use local Ollama API when no internet or remote API not configured
-            result = self._extract_with_local_api(image_bytes)
+            result = self._extract_with_local_api(image_bytes, cache_key)
         
-        # Cache the result
-        self._set_cached_result(cache_key, result)
         return result
     
     def _extract_with_remote_api(self, image_bytes):
@@ -124,7 +248,7 @@ class LicensePlateService:
                 'model': (None, self.model_name)
             }
             
-            response = requests.post(
+            response = self._session.post(
                 self.remote_api_url,
                 files=files,
                 headers={'accept': 'application/json'},
@@ -132,7 +256,7 @@ class LicensePlateService:
             )
             
             if response.status_code == 200:
-                response_data = response.json()
+                response_data = json_loads(response.content)
                 # Handle different response formats from remote API
                 if isinstance(response_data, dict):
                     if 'registrationNo' in response_data:
@@ -144,7 +268,7 @@ class LicensePlateService:
                 else:
                     license_plate = str(response_data)
                 
-                if license_plate and license_plate not in ['NOT_FOUND', 'ERROR_PROCESSING', 'PROCESSING_ERROR', '']:
+                if license_plate and license_plate not in NO_PLATE_RESULTS:
                     return {'plate': license_plate, 'valid': True, 'type': 'UNKNOWN'}
                 else:
                     return "NOT_FOUND"
@@ -158,12 +282,13 @@ class LicensePlateService:
             # Fallback to local API if remote API fails
             return self._extract_with_local_api(image_bytes)
     
-    def _extract_with_local_api(self, image_bytes):
+    def _extract_with_local_api(self, image_bytes, cache_key=None):
         """
         Extract license plate using local Ollama API with retry logic
         
         Args:
             image_bytes (bytes): Image data as bytes
+            cache_key (str): Precomputed _get_cache_key(image_bytes), if available
             
         Returns:
             str: Extracted license plate number or error message
@@ -171,48 +296,22 @@ class LicensePlateService:
         import time
         max_retries = 1
         
+        # Encode once for all attempts and fallbacks
+        image_data = self._encode_image(image_bytes, cache_key)
+        
         for attempt in range(max_retries):
             try:
-                # Convert image bytes to base64
-                image_data = base64.b64encode(image_bytes).decode('utf-8')
-                
-                # Prepare the prompt for license plate extraction
-                prompt = """Extract the Indian vehicle license plate number from the image. 
-                Return only the license plate number in the format XX00XX0000. 
-                If multiple plates are visible, return the most prominent one. 
-                If no license plate is found, return 'NOT_FOUND'."""
-                
-                # Prepare the payload for Ollama API with memory optimization
-                payload = {
-                    "model": self.model_name,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": prompt,
-                            "images": [image_data]
-                        }
-                    ],
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.1,   # Low temperature for consistent results
-                        "num_ctx": 256,       # Further reduce context size to save memory
-                        "num_predict": 16,    # Limit prediction length
-                        "low_vram": True,     # Enable low VRAM mode
-                        "repeat_penalty": 1.2, # Reduce repetition
-                        "top_k": 20,          # Limit vocabulary
-                        "top_p": 0.9,         # Nucleus sampling
-                        "mirostat": 1,        # Use Mirostat sampling
-                        "mirostat_tau": 5.0,  # Mirostat tau parameter
-                        "mirostat_eta": 0.1   # Mirostat eta parameter
-                    }
-                }
+                # Per-call payload: only the image changes (template built once in __init__)
+                payload = dict(self._ollama_payload,
+                               messages=[dict(self._ollama_message, images=[image_data])])
                 
                 # Make request to Ollama API
-                response = requests.post(
+                response = self._session.post(
                     f"{self.ollama_host}/api/chat",
-                    json=payload,
+                    data=json_dumps(payload),
                     headers={"Content-Type": "application/json"},
-                    timeout=15  # 15 seconds timeout for image processing
+                    timeout=15,  # 15 seconds timeout for image processing
+                    stream=True
                 )
                 
                 # Check if request was successful
@@ -231,9 +330,8 @@ class LicensePlateService:
                             continue
                     return "ERROR_PROCESSING"
                 
-                # Parse the response
-                response_data = response.json()
-                license_plate = response_data.get("message", {}).get("content", "").strip()
+                # Read the streamed answer (stops as soon as a complete plate has arrived)
+                license_plate = self._read_streamed_content(response)
                 
                 # Validate the extracted license plate
                 if not license_plate or license_plate == "NOT_FOUND":
@@ -241,7 +339,7 @@ class LicensePlateService:
                 
                 # Validate and clean the result
                 validation_result = validate_license_plate(license_plate)
-                if validation_result != 'invalid' and validation_result != 'invalid_state' and validation_result != 'invalid_bh_letters':
+                if validation_result not in INVALID_PLATE_TYPES:
                     return {'plate': license_plate, 'valid': True, 'type': validation_result}
                 else:
                     return {'plate': self._clean_license_plate(license_plate), 'valid': False, 'type': validation_result}
@@ -260,6 +358,27 @@ class LicensePlateService:
         
         return "PROCESSING_ERROR"
     
+    def _read_streamed_content(self, response):
+        """
+        Accumulate the content of a streamed Ollama chat response. Closes the
+        response as soon as a complete plate number has arrived, which aborts
+        the rest of the generation on the server.
+        """
+        parts = []
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json_loads(line)
+                parts.append(chunk.get("message", {}).get("content", ""))
+                if chunk.get("done"):
+                    break
+                if self._COMPLETE_PLATE_RE.search("".join(parts).upper().replace(" ", "")):
+                    break
+        finally:
+            response.close()
+        return "".join(parts).strip()
+    
     def _clean_license_plate(self, plate_text):
         """
         Clean and validate the extracted license plate text
@@ -270,9 +389,10 @@ class LicensePlateService:
         Returns:
             str: Cleaned license plate or the original if cleaning not needed
         """
-        # Remove common prefixes/suffixes that the model might add
-        cleaned = plate_text.replace("License Plate:", "").replace("Plate:", "").strip()
-        cleaned = cleaned.replace("Registration Number:", "").strip()
+        # Remove common labels that the model might add (all of them end in ':')
+        if ':' not in plate_text:
+            return plate_text.strip()
+        cleaned = self._LABEL_RE.sub('', plate_text).strip()
         
         # If the cleaned text looks like a valid Indian license plate, return it
         # Indian license plates typically have 2 letters, 2 digits, 2 letters, 4 digits
@@ -290,9 +410,6 @@ class LicensePlateService:
         Returns:
             dict: Results from both engines with timing information
         """
-        import threading
-        import time
-        
         results = {
             'ollama': None,
             'llamacpp': None,
@@ -305,46 +422,40 @@ class LicensePlateService:
             try:
                 result = self._extract_with_local_api(image_bytes)
                 duration = time.time() - start
-                results['ollama'] = {
+                logger.info(f"⚡ Ollama completed in {duration:.2f}s")
+                return {
                     'result': result,
                     'duration': duration,
-                    'success': result not in ['ERROR_PROCESSING', 'PROCESSING_ERROR', 'NOT_FOUND']
+                    'success': not (isinstance(result, str) and result in FAILED_RESULTS)
                 }
-                logger.info(f"⚡ Ollama completed in {duration:.2f}s")
             except Exception as e:
-                results['ollama'] = {'error': str(e), 'duration': time.time() - start, 'success': False}
+                return {'error': str(e), 'duration': time.time() - start, 'success': False}
         
         def run_llamacpp():
             if not self.llamacpp_service or not self.llamacpp_service.is_available():
-                results['llamacpp'] = {'error': 'Not available', 'duration': 0, 'success': False}
-                return
+                return {'error': 'Not available', 'duration': 0, 'success': False}
             
             if not image_path:
-                results['llamacpp'] = {'error': 'No image path provided', 'duration': 0, 'success': False}
-                return
+                return {'error': 'No image path provided', 'duration': 0, 'success': False}
             
             start = time.time()
             try:
                 result = self.llamacpp_service.extract_license_plate(image_path)
                 duration = time.time() - start
-                results['llamacpp'] = {
+                logger.info(f"⚡ LlamaCPP completed in {duration:.2f}s")
+                return {
                     'result': result,
                     'duration': duration,
                     'success': result is not None
                 }
-                logger.info(f"⚡ LlamaCPP completed in {duration:.2f}s")
             except Exception as e:
-                results['llamacpp'] = {'error': str(e), 'duration': time.time() - start, 'success': False}
-        
-        # Run both in parallel
-        t1 = threading.Thread(target=run_ollama)
-        t2 = threading.Thread(target=run_llamacpp)
-        
-        t1.start()
-        t2.start()
+                return {'error': str(e), 'duration': time.time() - start, 'success': False}
         
-        t1.join()
-        t2.join()
+        # Run both in parallel on the shared pool (no thread spawn per comparison)
+        ollama_future = self._comparison_pool.submit(run_ollama)
+        llamacpp_future = self._comparison_pool.submit(run_llamacpp)
+        results['ollama'] = ollama_future.result()
+        results['llamacpp'] = llamacpp_future.result()
         
         # Determine winner
         ollama_time = results['ollama']['duration'] if results['ollama'] and results['ollama'].get('success') else float('inf')
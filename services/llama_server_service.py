@@ -6,11 +6,25 @@ import requests
 import json
 import base64
 import threading
-from typing import Optional
+import atexit
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from utils.cpu_info import available_cpu_count, physical_core_count
 
 load_dotenv()
 
+# Fast JSON (de)serialization when installed; json_dumps always returns bytes and
+# orjson.loads raises a ValueError subclass, like json.loads
+try:
+    from orjson import loads as json_loads, dumps as json_dumps
+except ImportError:
+    json_loads = json.loads
+    
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
 logger = logging.getLogger(__name__)
 
 class LlamaServerService:
@@ -30,15 +44,36 @@ class LlamaServerService:
             
         logger.info("Initializing LlamaServer Service...")
         self.port = int(os.getenv("LLAMA_SERVER_PORT", "8081"))
+        # Server slots decoded together (continuous batching); each slot gets its own 2048 context
+        self.parallel = max(1, int(os.getenv("LLAMA_SERVER_PARALLEL", "4")))
+        # Layers offloaded to the GPU (99 = whole model; 0 = CPU only) and flash attention mode
+        self.gpu_layers = int(os.getenv("LLAMA_NGL", "99"))
+        self.flash_attn = os.getenv("LLAMA_FLASH_ATTN", "on")
+        # Decode is memory-bound: one thread per physical core (SMT siblings only add contention);
+        # prompt/image prefill is compute-bound and can use every available CPU
+        self.threads = int(os.getenv("LLAMA_THREADS", "0")) or physical_core_count()
+        self.threads_batch = int(os.getenv("LLAMA_THREADS_BATCH", "0")) or available_cpu_count()
+        # Optional llama.cpp NUMA mode (distribute | isolate | numactl) for multi-socket hosts
+        self.numa = os.getenv("LLAMA_NUMA", "")
         self.host = "127.0.0.1"
         self.base_url = f"http://{self.host}:{self.port}"
         
         self.model_path = os.getenv("LLAMA_MODEL_PATH")
         self.mmproj_path = os.getenv("LLAMA_MMPROJ_PATH")
-        self.server_path = "/home/raai/development/Refine_ALPR/llama.cpp/build/bin/llama-server"
+        self.server_path = os.getenv("LLAMA_SERVER_PATH", "/home/raai/development/Refine_ALPR/llama.cpp/build/bin/llama-server")
+        self.log_path = os.getenv("LLAMA_SERVER_LOG", "llama-server.log")
+        
+        # Keep-alive connection pool to the server (one TCP connection reused across requests)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount("http://", adapter)
+        
+        # Client threads for extract_license_plates, one per server slot
+        self._batch_pool = ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix="llama-batch")
         
         self.server_process = None
         self._ensure_server_running()
+        atexit.register(self.shutdown)
         self._initialized = True
 
     def _ensure_server_running(self):
@@ -54,44 +89,96 @@ class LlamaServerService:
             "-m", self.model_path,
             "--port", str(self.port),
             "--host", self.host,
-            "-c", "2048",  # Context size
-            "--n-gpu-layers", "0", # CPU only
-            "-t", "4"      # Threads
+            "-c", str(2048 * self.parallel),  # Context size (split across slots)
+            "--parallel", str(self.parallel),  # Concurrent requests share decode steps
+            "--cont-batching",
+            "--n-gpu-layers", str(self.gpu_layers),
+            "-t", str(self.threads),
+            "--threads-batch", str(self.threads_batch)
         ]
         
+        if self.numa:
+            cmd.extend(["--numa", self.numa])
+        
+        if self.gpu_layers > 0:
+            # Weights are copied to VRAM; don't keep a host mmap of the model around
+            cmd.append("--no-mmap")
+        if self.flash_attn:
+            cmd.extend(["--flash-attn", self.flash_attn])
+        
         if self.mmproj_path:
              cmd.extend(["--mmproj", self.mmproj_path])
         
         try:
-            # Start server in background
-            self.server_process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
+            # Start server in background. Output goes to a log file, not a pipe: nothing
+            # reads a pipe while the server runs, and per-request slot logging would fill it
+            # and block the server.
+            with open(self.log_path, 'ab') as log_file:
+                self.server_process = subprocess.Popen(
+                    cmd,
+                    stdout=log_file,
+                    stderr=subprocess.STDOUT
+                )
             
-            # Wait for server to start
+            # Wait for server to start (up to 30s), polling with exponential backoff
+            # from 50 ms so a fast start is noticed within ~100 ms instead of ~1 s
             logger.info("Waiting for LlamaServer to start...")
-            for _ in range(30):  # Wait up to 30 seconds
-                if self._check_health():
+            deadline = time.monotonic() + 30
+            delay = 0.05
+            while time.monotonic() < deadline:
+                if self._check_health(timeout=0.25):
                     logger.info("LlamaServer started successfully!")
+                    self._warmup()
                     return
-                time.sleep(1)
+                if self.server_process.poll() is not None:
+                    break  # Process exited; no point waiting for the timeout
+                time.sleep(delay)
+                delay = min(delay * 1.5, 1.0)
             
-            logger.error("LlamaServer failed to start within timeout")
+            logger.error("LlamaServer failed to start")
             # Check for errors
             if self.server_process.poll() is not None:
-                stdout, stderr = self.server_process.communicate()
-                logger.error(f"Server output: {stdout}\n{stderr}")
+                logger.error(f"Server output (tail of {self.log_path}):\n{self._log_tail()}")
                 
         except Exception as e:
             logger.error(f"Failed to start LlamaServer: {e}")
 
-    def _check_health(self) -> bool:
+    def _warmup(self):
+        """One throwaway image request so weights, the vision encoder and the KV cache
+        are resident before the first real plate (the first request otherwise pays for it)"""
+        try:
+            import cv2
+            import numpy as np
+            ok, buffer = cv2.imencode('.jpg', np.full((32, 32), 255, dtype=np.uint8))
+            if not ok:
+                return
+            payload = {
+                "prompt": "<|im_start|> User: hi<image> Assistant:",
+                "image_data": [{"data": base64.b64encode(buffer.tobytes()).decode('utf-8'), "id": 10}],
+                "n_predict": 1,
+                "cache_prompt": False
+            }
+            warmup_start = time.perf_counter()
+            self.session.post(f"{self.base_url}/completion", data=json_dumps(payload),
+                              headers={"Content-Type": "application/json"}, timeout=60)
+            logger.info(f"LlamaServer warmed up in {time.perf_counter() - warmup_start:.2f}s")
+        except Exception as e:
+            logger.warning(f"LlamaServer warmup failed: {e}")
+
+    def _log_tail(self, max_bytes: int = 4096) -> str:
+        """Last few KB of the server log (startup errors)"""
+        try:
+            with open(self.log_path, 'rb') as log_file:
+                log_file.seek(0, os.SEEK_END)
+                log_file.seek(max(0, log_file.tell() - max_bytes))
+                return log_file.read().decode('utf-8', 'replace')
+        except OSError as e:
+            return f"<unreadable: {e}>"
+
+    def _check_health(self, timeout: float = 1) -> bool:
         """Check if server is responsive"""
         try:
-            response = requests.get(f"{self.base_url}/health", timeout=1)
+            response = self.session.get(f"{self.base_url}/health", timeout=timeout)
             return response.status_code == 200
         except:
             return False
@@ -132,16 +219,19 @@ class LlamaServerService:
         }
         
         try:
-            response = requests.post(
+            request_start = time.perf_counter()
+            response = self.session.post(
                 f"{self.base_url}/completion",
-                json=payload,
+                data=json_dumps(payload),
+                headers={"Content-Type": "application/json"},
                 timeout=60
             )
+            request_time = time.perf_counter() - request_start
             
             if response.status_code == 200:
-                result = response.json()
+                result = json_loads(response.content)
                 content = result.get('content', '').strip()
-                logger.info(f"LlamaServer result: {content} in {time.time() - start_time:.2f}s")
+                logger.info(f"LlamaServer result: {content} in {time.time() - start_time:.2f}s (inference {request_time:.2f}s)")
                 return content
             else:
                 logger.error(f"Server returned error: {response.text}")
@@ -154,9 +244,20 @@ class LlamaServerService:
                 self._ensure_server_running()
             return None
 
+    def extract_license_plates(self, image_inputs) -> List[Optional[str]]:
+        """
+        Extract plates from several images at once. Requests are sent concurrently
+        so llama-server batches them across its --parallel slots.
+        Args:
+            image_inputs: Paths (str) or image bytes, one per image
+        Returns:
+            One result (or None) per input, in order
+        """
+        return list(self._batch_pool.map(self.extract_license_plate, image_inputs))
+
     def shutdown(self):
         """Stop the LlamaServer process"""
-        if self.server_process:
+        if self.server_process and self.server_process.poll() is None:
             logger.info("Stopping LlamaServer...")
             self.server_process.terminate()
             try:
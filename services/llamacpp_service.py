@@ -1,43 +1,80 @@
 """
 LlamaCPP Integration for License Plate OCR
-Provides CLI-based inference using llama.cpp with vision models
+Runs inference on a persistent llama-server (model stays loaded), with the
+llama.cpp CLI as a fallback
 """
 import subprocess
 import os
+import re
+import tempfile
 import logging
-from typing import Optional, Dict
+import threading
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 import cv2
 import numpy as np
+from utils.jpeg_header import jpeg_size
+from utils.cpu_info import physical_core_count
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Decode-time JPEG downscale factors, largest first
+_REDUCED_GRAYSCALE_FLAGS = ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+                            (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                            (2, cv2.IMREAD_REDUCED_GRAYSCALE_2))
+
+def _cuda_available() -> bool:
+    """True when OpenCV was built with CUDA and sees a GPU"""
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+# A bare plate line in CLI output (the answer is complete once this is printed)
+_CLI_PLATE_LINE_RE = re.compile(rb'^[A-Z0-9]{6,12}$')
+
 class LlamaCPPService:
-    # Class variable to cache model loading
-    _model_cache = {}
+    # Indian plate (e.g. KA 01 AB 1234) or BH-series (22 BH 1234 AA), optional spaces
+    _PLATE_RE = re.compile(r'\b([A-Z]{2}\s?\d{1,2}\s?[A-Z]{1,3}\s?\d{4}|\d{2}\s?BH\s?\d{4}\s?[A-Z]{1,2})\b')
+    _NO_PLATE_OUTPUTS = frozenset({'', 'NOT_FOUND'})
     
     def __init__(self):
         """Initialize LlamaCPP service with configuration from .env"""
         self.llama_cli_path = os.getenv("LLAMA_CLI_PATH", "./llama-llava-cli")
-        self.model_path = os.getenv("LLAMA_MODEL_PATH", "./models/Qwen2-VL-2B-Instruct-Q2_K.gguf")
+        self.model_path = os.getenv("LLAMA_MODEL_PATH", "./models/Qwen2-VL-2B-Instruct-Q4_K_M.gguf")
         self.mmproj_path = os.getenv("LLAMA_MMPROJ_PATH", "./models/mmproj-Qwen2-VL-2B-Instruct-f16.gguf")
         self.enabled = os.getenv("USE_LLAMA_CPP", "false").lower() == "true"
         # Optimization parameters
-        self.threads = int(os.getenv("LLAMA_THREADS", "4"))
+        # One thread per physical core unless overridden (SMT siblings slow llama.cpp down)
+        self.threads = int(os.getenv("LLAMA_THREADS", "0")) or physical_core_count()
         self.ctx_size = int(os.getenv("LLAMA_CTX_SIZE", "2048"))
-        self.cache_enabled = os.getenv("LLAMA_MODEL_CACHE", "true").lower() == "true"
-        # Cache key for this model configuration
-        self.cache_key = f"{self.model_path}_{self.mmproj_path}"
+        # Persistent llama-server keeps the model resident; the CLI reloads it on every call
+        self.use_server = os.getenv("LLAMA_CPP_USE_SERVER", "true").lower() == "true"
+        self._server = None
+        # Per-thread CLAHE instances (created once per thread, not per image)
+        self._local = threading.local()
+        # Run CLAHE on the GPU when OpenCV has CUDA (frees CPU cores for llama.cpp)
+        self.gpu_preprocess = (os.getenv("LLAMA_CPP_GPU_PREPROCESS", "true").lower() == "true"
+                               and _cuda_available())
+        if self.enabled and self.use_server:
+            self._get_server()
+    
+    def _get_server(self):
+        """Shared LlamaServerService (started once, reused by every request)"""
+        if self._server is None:
+            from services.llama_server_service import LlamaServerService
+            self._server = LlamaServerService()
+        return self._server
         
     def is_available(self) -> bool:
         """Check if LlamaCPP is available and configured"""
         if not self.enabled:
             return False
         
-        # Check if CLI exists
-        if not os.path.exists(self.llama_cli_path):
+        # Check if CLI exists (only needed without the server)
+        if not self.use_server and not os.path.exists(self.llama_cli_path):
             logger.warning(f"LlamaCPP CLI not found at: {self.llama_cli_path}")
             return False
         
@@ -53,53 +90,223 @@ class LlamaCPPService:
         
         return True
     
-    def preprocess_image(self, image_path: str) -> str:
+    @staticmethod
+    def _load_resized(image_path: str) -> Optional[np.ndarray]:
+        """Read an image as grayscale, downscaled to at most 640px on the longest side (None if unreadable)"""
+        max_size = 640
+        
+        # Let libjpeg downscale while decoding (DCT scaling) by the largest factor that
+        # still leaves at least max_size px; the resize below then only trims the rest
+        read_flag = cv2.IMREAD_GRAYSCALE
+        size = jpeg_size(image_path)
+        if size:
+            for factor, flag in _REDUCED_GRAYSCALE_FLAGS:
+                if max(size) // factor >= max_size:
+                    read_flag = flag
+                    break
+        
+        # Read image (plate OCR doesn't need color; decoding straight to gray skips a cvtColor)
+        img = cv2.imread(image_path, read_flag)
+        if img is None:
+            return None
+        
+        # Get decoded dimensions
+        h, w = img.shape[:2]
+        
+        # Resize to optimal size for LLM processing (max 640px on longest side)
+        if max(h, w) > max_size:
+            if h > w:
+                new_h = max_size
+                new_w = int(w * max_size / h)
+            else:
+                new_w = max_size
+                new_h = int(h * max_size / w)
+            
+            img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        
+        return img
+    
+    def _clahe(self):
+        """This thread's CLAHE instance"""
+        clahe = getattr(self._local, 'clahe', None)
+        if clahe is None:
+            clahe = self._local.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        return clahe
+    
+    def _apply_clahe(self, img: np.ndarray) -> np.ndarray:
+        """CLAHE on the GPU (one upload/download, per-thread GpuMats) or the CPU"""
+        if self.gpu_preprocess:
+            try:
+                local = self._local
+                if getattr(local, 'clahe_gpu', None) is None:
+                    local.clahe_gpu = cv2.cuda.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+                    local.gpu_src = cv2.cuda_GpuMat()
+                    local.gpu_dst = cv2.cuda_GpuMat()
+                local.gpu_src.upload(img)
+                local.clahe_gpu.apply(local.gpu_src, cv2.cuda_Stream.Null(), local.gpu_dst)
+                return local.gpu_dst.download()
+            except cv2.error as e:
+                logger.warning(f"CUDA CLAHE failed, using CPU: {e}")
+                self.gpu_preprocess = False
+        return self._clahe().apply(img)
+    
+    @staticmethod
+    def _is_ready_as_is(image_path: str, img: np.ndarray) -> bool:
+        """True for small, well-exposed JPEGs that can go to the model without preprocessing"""
+        size = jpeg_size(image_path)
+        if not size or max(size) > 640:
+            return False
+        # Exposure/contrast from a decimated sample (every 4th pixel each way)
+        mean, std = cv2.meanStdDev(img[::4, ::4])
+        return 60 < mean[0][0] < 200 and std[0][0] > 30
+    
+    def preprocess_image(self, image_path: str, img: Optional[np.ndarray] = None) -> Optional[bytes]:
         """
         Preprocess image for faster LLM processing
         Resize and enhance the image to optimize for license plate recognition
+        
+        Args:
+            image_path: Path to the image file
+            img: The already loaded and resized grayscale image, if available
+            
+        Returns:
+            Preprocessed image as JPEG bytes (kept in memory), or None on failure
         """
         try:
-            # Read image
-            img = cv2.imread(image_path)
             if img is None:
-                return image_path
+                img = self._load_resized(image_path)
+            if img is None:
+                return None
             
-            # Get original dimensions
-            h, w = img.shape[:2]
+            # Enhance contrast for better OCR (CLAHE directly on the gray image,
+            # no BGR->LAB->BGR round trip)
+            enhanced = self._apply_clahe(img)
             
-            # Resize to optimal size for LLM processing (max 640px on longest side)
-            max_size = 640
-            if max(h, w) > max_size:
-                if h > w:
-                    new_h = max_size
-                    new_w = int(w * max_size / h)
-                else:
-                    new_w = max_size
-                    new_h = int(h * max_size / w)
-                
-                img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+            # Encode in memory; the server takes the bytes directly (no temp file)
+            ok, buffer = cv2.imencode('.jpg', enhanced, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            return buffer.tobytes() if ok else None
+        except Exception as e:
+            logger.warning(f"Image preprocessing failed: {e}")
+            return None  # Caller falls back to the original image
+    
+    def _run_cli(self, image_path: str) -> Optional[str]:
+        """Run one llama.cpp CLI inference (loads the model every call); returns stdout or None"""
+        # SmolVLM2-specific prompt format: <|im_start|> User: {message}<image> Assistant:
+        prompt = "<|im_start|> User: Read the Indian license plate number from this image and return it in uppercase without any extra text.<image> Assistant:"
+        
+        # Build command with optimizations (removed --model-cache as it's not supported)
+        cmd = [
+            self.llama_cli_path,
+            "-m", self.model_path,
+            "--mmproj", self.mmproj_path,
+            "--image", image_path,
+            "-p", prompt,
+            "--temp", "0.1",      # Low temperature for deterministic output
+            "--top-k", "1",       # Greedy decoding
+            "-n", "16",           # Reduced max tokens for faster response
+            "--threads", str(self.threads),  # Use multiple threads
+            "--ctx-size", str(self.ctx_size), # Reduced context size
+            "--repeat-penalty", "1.2",  # Prevent repetition
+            "--mirostat", "0"     # Disable Mirostat for faster processing
+        ]
+        
+        # Execute command, streaming stdout so we can stop as soon as the plate line is out
+        # (instead of waiting for EOS and CLI teardown). stderr goes to a temp file so its
+        # log output can never fill a pipe and block the process.
+        with tempfile.TemporaryFile() as stderr_file:
+            # Bytes, not text=True: only the answer lines are ever decoded, not the
+            # model/backend banners
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file)
+            timed_out = threading.Event()
             
-            # Enhance contrast for better OCR
-            lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-            l, a, b = cv2.split(lab)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-            l = clahe.apply(l)
-            enhanced = cv2.merge((l, a, b))
-            enhanced = cv2.cvtColor(enhanced, cv2.COLOR_LAB2BGR)
+            def kill_on_timeout():
+                timed_out.set()
+                proc.kill()
             
-            # Save preprocessed image
-            base_name = os.path.splitext(image_path)[0]
-            processed_path = f"{base_name}_processed.jpg"
-            cv2.imwrite(processed_path, enhanced, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            timer = threading.Timer(120, kill_on_timeout)  # Increased timeout for SmolVLM2
+            timer.start()
+            lines = []
+            plate_seen = False
+            try:
+                for line in proc.stdout:
+                    lines.append(line)
+                    if _CLI_PLATE_LINE_RE.match(line.strip()):
+                        plate_seen = True
+                        proc.terminate()
+                        break
+            finally:
+                timer.cancel()
+                proc.stdout.close()
+                try:
+                    proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
             
-            return processed_path
-        except Exception as e:
-            logger.warning(f"Image preprocessing failed: {e}")
-            return image_path  # Return original if preprocessing fails
+            if timed_out.is_set():
+                raise subprocess.TimeoutExpired(cmd, 120)
+            if plate_seen:
+                return lines[-1].decode('ascii', 'ignore')
+            if proc.returncode != 0:
+                stderr_file.seek(0)
+                logger.error(f"LlamaCPP error: {stderr_file.read().decode('utf-8', 'replace')}")
+                return None
+            # The answer follows the prompt echo: decode just the last non-blank lines
+            tail = [line for line in lines[-8:] if line.strip()][-2:]
+            return b''.join(tail).decode('ascii', 'ignore')
+    
+    def _run_cli_on_bytes(self, image_path: str, processed_image: Optional[bytes]) -> Optional[str]:
+        """The CLI only reads files: write the preprocessed image next to the original for the call"""
+        if processed_image is None:
+            return self._run_cli(image_path)
+        
+        processed_path = f"{os.path.splitext(image_path)[0]}_processed.jpg"
+        with open(processed_path, 'wb') as f:
+            f.write(processed_image)
+        try:
+            return self._run_cli(processed_path)
+        finally:
+            try:
+                os.remove(processed_path)
+            except FileNotFoundError:
+                pass
+    
+    @classmethod
+    def _parse_plate(cls, output: str) -> Optional[str]:
+        """Return the first Indian-format plate in the model output (spaces removed), or None"""
+        output = output.strip().upper()
+        if output in cls._NO_PLATE_OUTPUTS:
+            return None
+        match = cls._PLATE_RE.search(output)
+        return match.group(1).replace(' ', '') if match else None
+    
+    def _prepare(self, image_path: str) -> Optional[bytes]:
+        """Load one image and preprocess it; None means send the original file"""
+        img = self._load_resized(image_path)
+        
+        # Small, well-lit crops are sent as they are
+        if img is not None and self._is_ready_as_is(image_path, img):
+            return None
+        return self.preprocess_image(image_path, img)
+    
+    def _finish(self, output: Optional[str]) -> Optional[str]:
+        """Parse model output into a plate"""
+        if output is None:
+            return None
+        
+        # Pull the plate out of the output (ignores prompt echo and extra words)
+        plate_text = self._parse_plate(output)
+        
+        if plate_text:
+            logger.info(f"LlamaCPP extracted: {plate_text}")
+            return plate_text
+        else:
+            logger.warning("LlamaCPP: No plate found")
+            return None
     
     def extract_license_plate(self, image_path: str) -> Optional[str]:
         """
-        Extract license plate using LlamaCPP CLI
+        Extract license plate using llama-server (or the LlamaCPP CLI fallback)
         
         Args:
             image_path: Path to the image file
@@ -112,57 +319,15 @@ class LlamaCPPService:
             return None
         
         try:
-            # Preprocess image for faster processing
-            processed_image_path = self.preprocess_image(image_path)
-            
-            # SmolVLM2-specific prompt format: <|im_start|> User: {message}<image> Assistant:
-            prompt = "<|im_start|> User: Read the Indian license plate number from this image and return it in uppercase without any extra text.<image> Assistant:"
-            
-            # Build command with optimizations (removed --model-cache as it's not supported)
-            cmd = [
-                self.llama_cli_path,
-                "-m", self.model_path,
-                "--mmproj", self.mmproj_path,
-                "--image", processed_image_path,
-                "-p", prompt,
-                "--temp", "0.1",      # Low temperature for deterministic output
-                "--top-k", "1",       # Greedy decoding
-                "-n", "16",           # Reduced max tokens for faster response
-                "--threads", str(self.threads),  # Use multiple threads
-                "--ctx-size", str(self.ctx_size), # Reduced context size
-                "--repeat-penalty", "1.2",  # Prevent repetition
-                "--mirostat", "0"     # Disable Mirostat for faster processing
-            ]
+            processed_image = self._prepare(image_path)
             
-            # Execute command
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=120  # Increased timeout for SmolVLM2
-            )
-            
-            # Clean up processed image
-            if processed_image_path != image_path and os.path.exists(processed_image_path):
-                os.remove(processed_image_path)
-            
-            if result.returncode == 0:
-                # Extract text from output
-                output = result.stdout.strip()
-                
-                # Clean up the output (remove prompt echo if present)
-                lines = output.split('\n')
-                plate_text = lines[-1].strip() if lines else ""
-                
-                if plate_text and plate_text != "NOT_FOUND":
-                    logger.info(f"LlamaCPP extracted: {plate_text}")
-                    return plate_text
-                else:
-                    logger.warning("LlamaCPP: No plate found")
-                    return None
+            if self.use_server:
+                output = self._get_server().extract_license_plate(
+                    processed_image if processed_image is not None else image_path)
             else:
-                logger.error(f"LlamaCPP error: {result.stderr}")
-                return None
+                output = self._run_cli_on_bytes(image_path, processed_image)
+            
+            return self._finish(output)
                 
         except subprocess.TimeoutExpired:
             logger.error("LlamaCPP timeout (>120s)")
@@ -171,6 +336,36 @@ class LlamaCPPService:
             logger.error(f"LlamaCPP exception: {e}")
             return None
     
+    def extract_license_plates_batch(self, image_paths: List[str]) -> List[Optional[str]]:
+        """
+        Extract plates from several crops (e.g. every vehicle in one frame). The crops
+        go to llama-server together so they decode in parallel slots.
+        
+        Returns:
+            One plate (or None) per input path, in order
+        """
+        if not self.use_server:
+            return [self.extract_license_plate(path) for path in image_paths]
+        if not self.is_available():
+            logger.error("LlamaCPP is not available")
+            return [None] * len(image_paths)
+        
+        results: List[Optional[str]] = [None] * len(image_paths)
+        pending = []  # (index, server input)
+        for index, image_path in enumerate(image_paths):
+            try:
+                processed_image = self._prepare(image_path)
+            except Exception as e:
+                logger.error(f"LlamaCPP exception: {e}")
+                continue
+            pending.append((index, processed_image if processed_image is not None else image_path))
+        
+        if pending:
+            outputs = self._get_server().extract_license_plates([item[1] for item in pending])
+            for (index, _), output in zip(pending, outputs):
+                results[index] = self._finish(output)
+        return results
+    
     def extract_with_timing(self, image_path: str) -> Dict:
         """
         Extract license plate with timing information
@@ -3,31 +3,66 @@ MongoDB Sync Module for ALPR System
 Handles asynchronous syncing of license plate records to MongoDB cloud storage
 """
 import os
+import queue
+import threading
+import time
 import logging
-from datetime import datetime
-from typing import Dict, Optional
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Database configuration, read once at import
+MONGODB_URI = os.getenv("MONGODB_URI")
+MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "lpr_system")
+MONGODB_COLLECTION = os.getenv("MONGODB_COLLECTION", "vehicle_logs")
+# Age out plate logs server-side after this many days (0 = keep forever)
+MONGODB_TTL_DAYS = int(os.getenv("MONGODB_TTL_DAYS", "0"))
+
+# Records are coalesced into one insert_many per batch (size or wait limit, whichever first)
+SYNC_BATCH_SIZE = 256
+SYNC_BATCH_WAIT = 0.5  # seconds
+SYNC_RETRIES = 3
+SYNC_STOP = None  # sentinel: flush and exit
+
 class MongoDBSync:
     def __init__(self):
         """Initialize MongoDB connection if configured"""
         self.enabled = False
         self.client = None
         self.collection = None
+        self._queue = queue.SimpleQueue()
+        self._flush_thread = None
         
-        mongo_uri = os.getenv("MONGODB_URI")
+        mongo_uri = MONGODB_URI
         if mongo_uri and mongo_uri.strip():
             try:
+                import pymongo
                 from pymongo import MongoClient
-                self.client = MongoClient(mongo_uri)
-                db_name = os.getenv("MONGODB_DATABASE", "lpr_system")
-                collection_name = os.getenv("MONGODB_COLLECTION", "vehicle_logs")
+                # BSON encode/decode runs in pure Python without the C extension (much slower)
+                if not pymongo.has_c():
+                    logger.warning("⚠️ pymongo C extension not available; reinstall from a binary wheel: pip install --force-reinstall pymongo")
+                # Plate logs are small, append-only and high volume: compress on the wire
+                # (codecs whose package is missing are skipped) and ack on the primary only
+                self.client = MongoClient(
+                    mongo_uri,
+                    maxPoolSize=64,
+                    compressors='zstd,snappy,zlib',
+                    retryWrites=True,
+                    w=1,
+                    journal=False,
+                    serverSelectionTimeoutMS=2000,
+                )
+                db_name = MONGODB_DATABASE
+                collection_name = MONGODB_COLLECTION
                 self.collection = self.client[db_name][collection_name]
+                self._create_indexes()
                 self.enabled = True
+                self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flush_thread.start()
                 logger.info(f"✅ MongoDB connected: {db_name}.{collection_name}")
             except ImportError:
                 logger.warning("⚠️ pymongo not installed. MongoDB sync disabled. Install: pip install pymongo")
@@ -36,31 +71,84 @@ class MongoDBSync:
         else:
             logger.info("ℹ️ MongoDB not configured (MONGODB_URI not set)")
     
+    def _create_indexes(self):
+        """Index epoch-ms timestamps; optional TTL on the BSON date timestamp"""
+        try:
+            self.collection.create_index('ts_ms')
+            if MONGODB_TTL_DAYS > 0:
+                self.collection.create_index('timestamp', expireAfterSeconds=MONGODB_TTL_DAYS * 86400)
+        except Exception as e:
+            logger.warning(f"⚠️ MongoDB index creation failed: {e}")
+    
     def sync_record(self, record: Dict) -> bool:
         """
-        Sync a license plate record to MongoDB
+        Queue a license plate record for MongoDB (written in batches by the flush thread)
         
         Args:
             record: Dictionary containing plate data
             
         Returns:
-            True if successful, False otherwise
+            True if queued, False if sync is disabled
         """
         if not self.enabled:
             return False
         
-        try:
-            # Add timestamp if not present
-            if 'timestamp' not in record:
-                record['timestamp'] = datetime.now().isoformat()
-            
-            # Insert into MongoDB
-            result = self.collection.insert_one(record)
-            logger.info(f"☁️ Synced to MongoDB: {record.get('plate', 'UNKNOWN')} (ID: {result.inserted_id})")
-            return True
-        except Exception as e:
-            logger.error(f"❌ MongoDB sync failed: {e}")
-            return False
+        # Timestamps as BSON date + int64 epoch ms (compact, range-queryable, TTL-able)
+        now_ms = time.time_ns() // 1_000_000
+        record.setdefault('ts_ms', now_ms)
+        if 'timestamp' not in record:
+            record['timestamp'] = datetime.fromtimestamp(now_ms / 1000, timezone.utc)
+        
+        self._queue.put(record)
+        return True
+    
+    def _flush_loop(self):
+        """Drain the queue into insert_many batches until the stop sentinel arrives"""
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + SYNC_BATCH_WAIT
+            while len(batch) < SYNC_BATCH_SIZE and batch[-1] is not SYNC_STOP:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch[-1] is SYNC_STOP:
+                running = False
+                batch.pop()
+            if batch:
+                self._insert_batch(batch)
+    
+    def _insert_batch(self, batch: List[Dict]):
+        """insert_many with retry on transient connection errors"""
+        from pymongo.errors import AutoReconnect, BulkWriteError
+        
+        for attempt in range(SYNC_RETRIES):
+            try:
+                result = self.collection.insert_many(batch, ordered=False)
+                logger.info(f"☁️ Synced {len(result.inserted_ids)} record(s) to MongoDB")
+                return
+            except AutoReconnect as e:
+                logger.warning(f"⚠️ MongoDB sync retry {attempt + 1}/{SYNC_RETRIES}: {e}")
+                time.sleep(0.5 * (attempt + 1))
+            except BulkWriteError as e:
+                # ordered=False: everything except the failed documents was written
+                logger.error(f"❌ MongoDB sync failed for {len(e.details.get('writeErrors', []))} record(s)")
+                return
+            except Exception as e:
+                logger.error(f"❌ MongoDB sync failed: {e}")
+                return
+        logger.error(f"❌ MongoDB sync failed: dropped {len(batch)} record(s) after {SYNC_RETRIES} attempts")
+    
+    def close(self):
+        """Write everything queued, then stop the flush thread (shutdown)"""
+        if self._flush_thread is not None:
+            self._queue.put(SYNC_STOP)
+            self._flush_thread.join(timeout=5)
+            self._flush_thread = None
     
     def is_enabled(self) -> bool:
         """Check if MongoDB sync is enabled"""
@@ -7,9 +7,62 @@ Implements security features:
 - Duplicate entry detection
 """
 
-from typing import Dict, Optional
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 from services.session_manager import SessionManager
 
+# Order matches SessionManager._vehicle_key
+VEHICLE_FIELDS = ('make', 'model', 'color', 'type')
+
+# Marks "session not pre-fetched" (None already means "no active session")
+_NOT_FETCHED = object()
+
+
+class _Result:
+    """Slots result base; still readable like the dicts these replaced (result['action'])"""
+    __slots__ = ()
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+    
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+    
+    def to_dict(self) -> Dict:
+        """Plain dict (nested results included) for MongoDB / JSON"""
+        return {name: value.to_dict() if isinstance(value, _Result) else value
+                for name, value in ((name, getattr(self, name)) for name in self.__slots__)}
+
+
+@dataclass(slots=True)
+class ConfidenceResult(_Result):
+    action: str  # 'ACCEPT', 'REVIEW', 'REJECT'
+    reason: str
+    review_id: Optional[str] = None
+
+
+@dataclass(slots=True)
+class SwapResult(_Result):
+    is_swap: bool
+    severity: str
+    mismatches: List[str]
+    details: Dict
+
+
+@dataclass(slots=True)
+class ValidationResult(_Result):
+    valid: bool
+    action: str
+    alerts: List[str] = field(default_factory=list)
+    reason: Optional[str] = None
+    review_id: Optional[str] = None
+    swap_detected: bool = False
+    swap_details: Optional[SwapResult] = None
+
+
 class SecurityChecker:
     """Security validation for ANPR detections"""
     
@@ -27,36 +80,27 @@ class SecurityChecker:
         self.critical_confidence_threshold = 0.3
     
     def check_plate_swap(self, plate: str, entry_vehicle: Dict, 
-                        exit_vehicle: Dict) -> Dict:
+                        exit_vehicle: Dict, entry_key: Optional[List[str]] = None) -> SwapResult:
         """
         Detect potential plate swap attack
         
         Scenario: Thief enters with valid plate on cheap car,
                  swaps plate to luxury car inside, tries to exit
         
+        Args:
+            entry_key: Pre-normalized entry vehicle key stored on the session
+                       (computed from entry_vehicle when missing)
+        
         Returns:
-            {
-                'is_swap': bool,
-                'severity': str,
-                'details': dict
-            }
+            SwapResult(is_swap, severity, mismatches, details)
         """
-        # Compare vehicle metadata
-        make_match = entry_vehicle.get('make', '').lower() == exit_vehicle.get('make', '').lower()
-        model_match = entry_vehicle.get('model', '').lower() == exit_vehicle.get('model', '').lower()
-        color_match = entry_vehicle.get('color', '').lower() == exit_vehicle.get('color', '').lower()
-        type_match = entry_vehicle.get('type', '').lower() == exit_vehicle.get('type', '').lower()
+        # Compare vehicle metadata on lowercased (make, model, color, type) keys
+        entry_key = entry_key or SessionManager._vehicle_key(entry_vehicle)
+        exit_key = SessionManager._vehicle_key(exit_vehicle)
         
         # Determine severity
-        mismatches = []
-        if not make_match:
-            mismatches.append('make')
-        if not model_match:
-            mismatches.append('model')
-        if not color_match:
-            mismatches.append('color')
-        if not type_match:
-            mismatches.append('type')
+        mismatches = [field for field, entry_value, exit_value
+                      in zip(VEHICLE_FIELDS, entry_key, exit_key) if entry_value != exit_value]
         
         is_swap = len(mismatches) > 0
         
@@ -70,11 +114,11 @@ class SecurityChecker:
         else:
             severity = "LOW"  # No mismatch
         
-        return {
-            'is_swap': is_swap,
-            'severity': severity,
-            'mismatches': mismatches,
-            'details': {
+        return SwapResult(
+            is_swap=is_swap,
+            severity=severity,
+            mismatches=mismatches,
+            details={
                 'entry': entry_vehicle,
                 'exit': exit_vehicle,
                 'comparison': {
@@ -84,26 +128,23 @@ class SecurityChecker:
                     'type': f"{entry_vehicle.get('type')} → {exit_vehicle.get('type')}"
                 }
             }
-        }
+        )
+    
+    @staticmethod
+    def _reject_reason(confidence: float) -> str:
+        """Reason text for a very-low-confidence reject"""
+        return f'Very low confidence ({confidence:.2f}) - rejected'
     
     def check_confidence(self, plate: str, confidence: float, 
-                        image_path: str) -> Dict:
+                        image_path: str) -> ConfidenceResult:
         """
         Check detection confidence and flag for review if needed
         
         Returns:
-            {
-                'action': str,  # 'ACCEPT', 'REVIEW', 'REJECT'
-                'reason': str,
-                'review_id': str (if flagged)
-            }
+            ConfidenceResult(action, reason, review_id (if flagged))
         """
         if confidence >= self.low_confidence_threshold:
-            return {
-                'action': 'ACCEPT',
-                'reason': f'High confidence ({confidence:.2f})',
-                'review_id': None
-            }
+            return ConfidenceResult('ACCEPT', f'High confidence ({confidence:.2f})')
         
         elif confidence >= self.critical_confidence_threshold:
             # Flag for manual review
@@ -114,31 +155,28 @@ class SecurityChecker:
                 reason=f"Low confidence detection ({confidence:.2f})"
             )
             
-            return {
-                'action': 'REVIEW',
-                'reason': f'Low confidence ({confidence:.2f}) - flagged for review',
-                'review_id': review_id
-            }
+            return ConfidenceResult('REVIEW', f'Low confidence ({confidence:.2f}) - flagged for review',
+                                    review_id)
         
         else:
             # Too low - reject
-            return {
-                'action': 'REJECT',
-                'reason': f'Very low confidence ({confidence:.2f}) - rejected',
-                'review_id': None
-            }
+            return ConfidenceResult('REJECT', self._reject_reason(confidence))
     
-    def check_duplicate_entry(self, plate: str) -> Dict:
+    def check_duplicate_entry(self, plate: str, active_session=_NOT_FETCHED) -> Dict:
         """
         Check if vehicle is trying to enter while already inside
         
+        Args:
+            active_session: Session already fetched by the caller (skips the lookup)
+        
         Returns:
             {
                 'is_duplicate': bool,
                 'existing_session': str (session_id if duplicate)
             }
         """
-        active_session = self.session_manager.find_active_session(plate)
+        if active_session is _NOT_FETCHED:
+            active_session = self.session_manager.find_active_session(plate)
         
         if active_session:
             return {
@@ -152,17 +190,21 @@ class SecurityChecker:
             'existing_session': None
         }
     
-    def check_exit_without_entry(self, plate: str) -> Dict:
+    def check_exit_without_entry(self, plate: str, active_session=_NOT_FETCHED) -> Dict:
         """
         Check if vehicle is trying to exit without entry record
         
+        Args:
+            active_session: Session already fetched by the caller (skips the lookup)
+        
         Returns:
             {
                 'has_entry': bool,
                 'session_id': str (if found)
             }
         """
-        active_session = self.session_manager.find_active_session(plate)
+        if active_session is _NOT_FETCHED:
+            active_session = self.session_manager.find_active_session(plate)
         
         if active_session:
             return {
@@ -176,107 +218,75 @@ class SecurityChecker:
         }
     
     def validate_entry(self, plate: str, vehicle_data: Dict, 
-                      confidence: float, image_path: str) -> Dict:
+                      confidence: float, image_path: str) -> ValidationResult:
         """
         Complete entry validation
         
         Returns:
-            {
-                'valid': bool,
-                'action': str,
-                'alerts': list,
-                'review_id': str
-            }
+            ValidationResult(valid, action, alerts, reason, review_id)
         """
+        # Very-low-confidence noise is the dominant case: reject without the confidence check
+        if confidence < self.critical_confidence_threshold:
+            return ValidationResult(False, 'REJECT', reason=self._reject_reason(confidence))
+        
         alerts = []
         review_id = None
         
-        # Check 1: Confidence
+        # Check 1: Confidence (ACCEPT or REVIEW here; REJECT returned above)
         conf_check = self.check_confidence(plate, confidence, image_path)
-        if conf_check['action'] == 'REJECT':
-            return {
-                'valid': False,
-                'action': 'REJECT',
-                'reason': conf_check['reason'],
-                'alerts': alerts,
-                'review_id': None
-            }
-        elif conf_check['action'] == 'REVIEW':
-            review_id = conf_check['review_id']
+        if conf_check.action == 'REVIEW':
+            review_id = conf_check.review_id
             alerts.append('LOW_CONFIDENCE')
         
         # Check 2: Duplicate entry
-        dup_check = self.check_duplicate_entry(plate)
+        session = self.session_manager.find_active_session_cached(plate)
+        dup_check = self.check_duplicate_entry(plate, session)
         if dup_check['is_duplicate']:
             alerts.append('DUPLICATE_ENTRY')
         
-        return {
-            'valid': True,
-            'action': conf_check['action'],
-            'alerts': alerts,
-            'review_id': review_id
-        }
+        return ValidationResult(True, conf_check.action, alerts, review_id=review_id)
     
     def validate_exit(self, plate: str, vehicle_data: Dict,
-                     confidence: float, image_path: str) -> Dict:
+                     confidence: float, image_path: str) -> ValidationResult:
         """
         Complete exit validation
         
         Returns:
-            {
-                'valid': bool,
-                'action': str,
-                'alerts': list,
-                'swap_detected': bool
-            }
+            ValidationResult(valid, action, alerts, reason, swap_detected, swap_details)
         """
+        # Very-low-confidence noise is the dominant case: reject without the confidence check
+        if confidence < self.critical_confidence_threshold:
+            return ValidationResult(False, 'REJECT', reason=self._reject_reason(confidence))
+        
         alerts = []
         
-        # Check 1: Confidence
+        # Check 1: Confidence (ACCEPT or REVIEW here; REJECT returned above)
         conf_check = self.check_confidence(plate, confidence, image_path)
-        if conf_check['action'] == 'REJECT':
-            return {
-                'valid': False,
-                'action': 'REJECT',
-                'reason': conf_check['reason'],
-                'alerts': alerts,
-                'swap_detected': False
-            }
-        elif conf_check['action'] == 'REVIEW':
+        if conf_check.action == 'REVIEW':
             alerts.append('LOW_CONFIDENCE')
         
-        # Check 2: Exit without entry
-        entry_check = self.check_exit_without_entry(plate)
+        # Check 2: Exit without entry (one session lookup shared with the swap check)
+        session = self.session_manager.find_active_session_cached(plate)
+        entry_check = self.check_exit_without_entry(plate, session)
         if not entry_check['has_entry']:
             alerts.append('EXIT_WITHOUT_ENTRY')
-            return {
-                'valid': False,
-                'action': 'ALERT',
-                'reason': 'No entry record found',
-                'alerts': alerts,
-                'swap_detected': False
-            }
+            return ValidationResult(False, 'ALERT', alerts, reason='No entry record found')
         
         # Check 3: Plate swap
-        session = self.session_manager.find_active_session(plate)
         if session:
             entry_vehicle = session['entry']['vehicle']
-            swap_check = self.check_plate_swap(plate, entry_vehicle, vehicle_data)
+            swap_check = self.check_plate_swap(plate, entry_vehicle, vehicle_data,
+                                               session['entry'].get('vehicle_key'))
             
-            if swap_check['is_swap']:
+            if swap_check.is_swap:
                 alerts.append('PLATE_SWAP')
-                return {
-                    'valid': True,  # Process but flag
-                    'action': 'ALERT',
-                    'reason': 'Vehicle metadata mismatch detected',
-                    'alerts': alerts,
-                    'swap_detected': True,
-                    'swap_details': swap_check
-                }
+                return ValidationResult(
+                    True,  # Process but flag
+                    'ALERT',
+                    alerts,
+                    reason='Vehicle metadata mismatch detected',
+                    swap_detected=True,
+                    swap_details=swap_check
+                )
         
-        return {
-            'valid': True,
-            'action': conf_check['action'],
-            'alerts': alerts,
-            'swap_detected': False
-        }
+        return ValidationResult(True, conf_check.action, alerts)
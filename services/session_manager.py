@@ -9,7 +9,9 @@ Handles:
 - Security alerts
 """
 
-from pymongo import MongoClient, ASCENDING, DESCENDING
+import pymongo
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List, Tuple
 import os
@@ -17,17 +19,27 @@ from bson import ObjectId
 import gridfs
 import time
 import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Database configuration, read once at import
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+MONGODB_DB = os.getenv("MONGODB_DB", "anpr_system")
 
 class SessionManager:
     """Manages vehicle entry/exit sessions in MongoDB"""
     
     def __init__(self):
         """Initialize MongoDB connection and GridFS"""
-        mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-        db_name = os.getenv("MONGODB_DB", "anpr_system")
+        # BSON encode/decode runs in pure Python without the C extension (much slower)
+        if not pymongo.has_c():
+            print("⚠️ pymongo C extension not available; reinstall from a binary wheel: pip install --force-reinstall pymongo")
         
-        self.client = MongoClient(mongodb_uri)
-        self.db = self.client[db_name]
+        self.client = MongoClient(MONGODB_URI)
+        self.db = self.client[MONGODB_DB]
         
         # Collections
         self.sessions = self.db.sessions
@@ -41,6 +53,13 @@ class SessionManager:
         # Event matching configuration
         self.match_window_seconds = 8  # Time window for front/rear matching
         
+        # Recent find_active_session(plate) results (LRU). Entries are dropped when this
+        # process writes the plate's session; the short TTL bounds staleness from other writers
+        self._active_cache = OrderedDict()
+        self._active_cache_lock = threading.Lock()
+        self._active_cache_ttl = 2  # seconds
+        self._active_cache_max_size = 2048
+        
         # Create indexes
         self._create_indexes()
     
@@ -63,10 +82,25 @@ class SessionManager:
             # Pending events indexes (for event matching)
             self.pending_events.create_index([("timestamp", ASCENDING)], expireAfterSeconds=30)
             self.pending_events.create_index([("camera_id", ASCENDING)])
+            # Covers _find_matching_event: equality on processed, range on timestamp,
+            # then camera_id, so matching scans only events inside the time window
+            self.pending_events.create_index([("processed", ASCENDING), ("timestamp", ASCENDING),
+                                              ("camera_id", ASCENDING)])
             
             print("✅ MongoDB indexes created")
         except Exception as e:
             print(f"⚠️ Index creation warning: {e}")
+        
+        try:
+            # At most one INSIDE session per plate: makes the entry upsert atomic across
+            # concurrent writers (the losing upsert gets a DuplicateKeyError)
+            self.sessions.create_index(
+                [("plate", ASCENDING)],
+                unique=True,
+                partialFilterExpression={"status": "INSIDE", "plate": {"$type": "string"}}
+            )
+        except Exception as e:
+            print(f"⚠️ Index creation warning: {e}")
     
     def generate_temp_id(self, vehicle_data: Dict, timestamp: datetime) -> str:
         """
@@ -98,7 +132,10 @@ class SessionManager:
                 'image_path': image_path,
                 'confidence': confidence,
                 'timestamp': current_time,
-                'processed': False
+                'processed': False,
+                # Normalized metadata, computed once here and stored with the pending event
+                # so later arrivals compare against it without re-normalizing
+                'vehicle_key': self._vehicle_key(vehicle_data)
             }
             
             # Try to find matching event from opposite camera
@@ -140,11 +177,10 @@ class SessionManager:
             best_match = None
             best_score = 0
             
+            event_key = event['vehicle_key']
             for candidate in candidates:
-                score = self._calculate_metadata_match_score(
-                    event['vehicle'],
-                    candidate['vehicle']
-                )
+                candidate_key = candidate.get('vehicle_key') or self._vehicle_key(candidate['vehicle'])
+                score = self._match_score_keys(event_key, candidate_key, min_score=3)
                 
                 if score > best_score and score >= 3:  # Require 3/4 match
                     best_score = score
@@ -156,22 +192,47 @@ class SessionManager:
             print(f"❌ Match finding error: {e}")
             return None
     
-    def _calculate_metadata_match_score(self, vehicle1: Dict, vehicle2: Dict) -> int:
+    def _calculate_metadata_match_score(self, vehicle1: Dict, vehicle2: Dict,
+                                        min_score: int = 0) -> int:
         """
         Calculate metadata match score (0-4)
         Require 3/4 for confident match
+        
+        Stops comparing once min_score is out of reach (the partial score
+        returned is then below min_score, which callers treat as no match)
         """
         score = 0
+        misses_allowed = 4 - min_score
         
         # Compare each field
-        if vehicle1.get('make', '').lower() == vehicle2.get('make', '').lower():
-            score += 1
-        if vehicle1.get('model', '').lower() == vehicle2.get('model', '').lower():
-            score += 1
-        if vehicle1.get('color', '').lower() == vehicle2.get('color', '').lower():
-            score += 1
-        if vehicle1.get('type', '').lower() == vehicle2.get('type', '').lower():
-            score += 1
+        for field in ('make', 'model', 'color', 'type'):
+            if vehicle1.get(field, '').lower() == vehicle2.get(field, '').lower():
+                score += 1
+            else:
+                misses_allowed -= 1
+                if misses_allowed < 0:
+                    break
+        
+        return score
+    
+    @staticmethod
+    def _vehicle_key(vehicle: Dict) -> List[str]:
+        """Lowercased make/model/color/type, in match-score order"""
+        return [(vehicle.get(field) or '').lower() for field in ('make', 'model', 'color', 'type')]
+    
+    @staticmethod
+    def _match_score_keys(key1: List[str], key2: List[str], min_score: int = 0) -> int:
+        """_calculate_metadata_match_score on pre-normalized keys from _vehicle_key"""
+        score = 0
+        misses_allowed = 4 - min_score
+        
+        for value1, value2 in zip(key1, key2):
+            if value1 == value2:
+                score += 1
+            else:
+                misses_allowed -= 1
+                if misses_allowed < 0:
+                    break
         
         return score
     
@@ -237,39 +298,14 @@ class SessionManager:
             # Generate plate or temp_id
             if plate:
                 identifier = plate
-                # Check for duplicate entry
-                existing = self.find_active_session(plate)
-                if existing:
-                    self.create_alert(
-                        alert_type="DUPLICATE_ENTRY",
-                        severity="MEDIUM",
-                        plate=plate,
-                        details={
-                            "message": "Vehicle tried to enter while already inside",
-                            "existing_session": existing['session_id']
-                        }
-                    )
-                    return existing['session_id']
             else:
                 # No plate - generate temp ID
                 identifier = self.generate_temp_id(vehicle_data, merged_event['timestamp'])
             
-            # Store images in GridFS
-            gridfs_front = self.store_image(merged_event['image_front'], {
-                "type": "entry_front",
-                "plate": plate,
-                "camera_id": merged_event['camera_front']
-            })
-            gridfs_rear = self.store_image(merged_event['image_rear'], {
-                "type": "entry_rear",
-                "plate": plate,
-                "camera_id": merged_event['camera_rear']
-            })
-            
             # Generate session ID
             session_id = f"SESSION_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{identifier}"
             
-            # Create session document
+            # Create session document (images are stored once the entry is accepted)
             session = {
                 "session_id": session_id,
                 "plate": plate,
@@ -279,9 +315,10 @@ class SessionManager:
                     "timestamp": merged_event['timestamp'],
                     "camera_front": merged_event['camera_front'],
                     "camera_rear": merged_event['camera_rear'],
-                    "image_front": gridfs_front,
-                    "image_rear": gridfs_rear,
+                    "image_front": None,
+                    "image_rear": None,
                     "vehicle": vehicle_data,
+                    "vehicle_key": self._vehicle_key(vehicle_data),
                     "confidence": merged_event['confidence'],
                     "verified": merged_event['verified']
                 },
@@ -295,6 +332,54 @@ class SessionManager:
                 "updated_at": datetime.now()
             }
             
+            if plate:
+                # Insert only if the vehicle is not already inside. The partial unique index
+                # on INSIDE plates makes this atomic: a concurrent duplicate either matches
+                # the existing session or fails with DuplicateKeyError.
+                for attempt in range(2):
+                    try:
+                        existing = self.sessions.find_one_and_update(
+                            {"plate": plate, "status": "INSIDE"},
+                            {"$setOnInsert": session},
+                            projection={"session_id": 1},
+                            upsert=True,
+                            return_document=ReturnDocument.BEFORE
+                        )
+                        break
+                    except DuplicateKeyError:
+                        # Lost an insert race: retry once, which now matches the winner's
+                        # session (or inserts, if that session has already closed)
+                        if attempt:
+                            raise
+                if existing is not None:
+                    # Duplicate entry - nothing was stored for this event
+                    existing_id = existing['session_id']
+                    self.create_alert(
+                        alert_type="DUPLICATE_ENTRY",
+                        severity="MEDIUM",
+                        plate=plate,
+                        details={
+                            "message": "Vehicle tried to enter while already inside",
+                            "existing_session": existing_id
+                        }
+                    )
+                    return existing_id
+                self._invalidate_active_session(plate)
+            
+            # Store images in GridFS
+            gridfs_front = self.store_image(merged_event['image_front'], {
+                "type": "entry_front",
+                "plate": plate,
+                "camera_id": merged_event['camera_front']
+            })
+            gridfs_rear = self.store_image(merged_event['image_rear'], {
+                "type": "entry_rear",
+                "plate": plate,
+                "camera_id": merged_event['camera_rear']
+            })
+            session['entry']['image_front'] = gridfs_front
+            session['entry']['image_rear'] = gridfs_rear
+            
             # Flag for manual review if no plate
             if not has_plate:
                 review_id = self.flag_for_manual_review(
@@ -305,7 +390,17 @@ class SessionManager:
                 )
                 session['alerts'].append(review_id)
             
-            result = self.sessions.insert_one(session)
+            if plate:
+                self.sessions.update_one(
+                    {"session_id": session_id},
+                    {"$set": {
+                        "entry.image_front": gridfs_front,
+                        "entry.image_rear": gridfs_rear,
+                        "alerts": session['alerts']
+                    }}
+                )
+            else:
+                self.sessions.insert_one(session)
             
             status_emoji = "✅" if has_plate else "⚠️"
             print(f"{status_emoji} Entry session created: {session_id} [{identifier}]")
@@ -339,34 +434,63 @@ class SessionManager:
             print(f"❌ Session lookup error: {e}")
             return None
     
+    def find_active_session_cached(self, plate: str) -> Optional[Dict]:
+        """find_active_session(plate) served from the recent-lookup LRU when fresh"""
+        now = time.monotonic()
+        with self._active_cache_lock:
+            entry = self._active_cache.get(plate)
+            if entry is not None and now - entry[0] < self._active_cache_ttl:
+                self._active_cache.move_to_end(plate)
+                return entry[1]
+        
+        session = self.find_active_session(plate)
+        with self._active_cache_lock:
+            self._active_cache[plate] = (now, session)
+            self._active_cache.move_to_end(plate)
+            if len(self._active_cache) > self._active_cache_max_size:
+                self._active_cache.popitem(last=False)
+        return session
+    
+    def _invalidate_active_session(self, plate: str):
+        """Forget the cached active-session lookup for a plate (after writing its session)"""
+        with self._active_cache_lock:
+            self._active_cache.pop(plate, None)
+    
     def _find_session_by_metadata(self, vehicle_data: Dict) -> Optional[Dict]:
         """
         Find active session by vehicle metadata (for no-plate vehicles)
         """
         try:
-            # Get all active sessions without plates
+            # Get active sessions without plates. Entries older than 60 minutes get no
+            # time bonus and so can never reach the required score of 5 - skip them here.
+            now = datetime.now()
             candidates = self.sessions.find({
                 "status": "INSIDE",
-                "has_plate": False
+                "has_plate": False,
+                "entry.timestamp": {"$gt": now - timedelta(minutes=60)}
             })
             
             best_match = None
             best_score = 0
             
             for candidate in candidates:
+                # Time-based scoring first (prefer recent entries); it sets how many
+                # metadata fields must match
+                time_diff = (now - candidate['entry']['timestamp']).total_seconds() / 60
+                if time_diff < 30:  # < 30 minutes
+                    time_bonus = 2
+                elif time_diff < 60:  # < 60 minutes
+                    time_bonus = 1
+                else:
+                    continue
+                
                 # Calculate match score
-                score = self._calculate_metadata_match_score(
+                score = time_bonus + self._calculate_metadata_match_score(
                     candidate['entry']['vehicle'],
-                    vehicle_data
+                    vehicle_data,
+                    min_score=5 - time_bonus
                 )
                 
-                # Add time-based scoring (prefer recent entries)
-                time_diff = (datetime.now() - candidate['entry']['timestamp']).total_seconds() / 60
-                if time_diff < 30:  # < 30 minutes
-                    score += 2
-                elif time_diff < 60:  # < 60 minutes
-                    score += 1
-                
                 if score > best_score and score >= 5:  # Require high confidence
                     best_score = score
                     best_match = candidate
@@ -487,6 +611,8 @@ class SessionManager:
                 {"_id": session['_id']},
                 update_data
             )
+            if session.get('plate'):
+                self._invalidate_active_session(session['plate'])
             
             identifier = plate or session.get('temp_id', 'UNKNOWN')
             status_emoji = "✅" if (metadata_match and not plate_mismatch) else "🚨"
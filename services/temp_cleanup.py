@@ -3,13 +3,21 @@ Temp File Cleanup Module
 Manages cleanup of temporary screenshot files to prevent disk space issues
 """
 import os
-import glob
+import heapq
 import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# Worker threads used to unlink a burst of due files
+DELETE_WORKERS = 8
+
+# Temp image file extensions
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+
 class TempFileCleanup:
     def __init__(self, temp_dir="temp_screenshots", max_age_hours=1):
         """
@@ -22,37 +30,110 @@ class TempFileCleanup:
         self.temp_dir = temp_dir
         self.max_age_seconds = max_age_hours * 3600
         
+        # Deletion deadlines: {filename: deadline} plus a min-heap of (deadline, filename),
+        # so a cleanup pass only touches files that are due instead of globbing the directory
+        self._deadlines = {}
+        self._heap = []
+        self._lock = threading.Lock()
+        
+        # Background cleanup thread sleeps until the earliest deadline (or a wake-up)
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+        self._deleter = None
+        
         # Create directory if it doesn't exist
         Path(temp_dir).mkdir(parents=True, exist_ok=True)
+        
+        # Files left over from a previous run are scheduled from their mtime
+        self._schedule_existing_files()
+    
+    def _image_entries(self):
+        """Temp image files, from a single directory read (one readdir instead of a glob per pattern)"""
+        with os.scandir(self.temp_dir) as entries:
+            return [entry for entry in entries
+                    if entry.name.endswith(IMAGE_SUFFIXES) and entry.is_file()]
+    
+    def _schedule_existing_files(self):
+        """Seed the deadline heap from files already in the temp directory"""
+        for entry in self._image_entries():
+            try:
+                deadline = entry.stat().st_mtime + self.max_age_seconds
+            except OSError:
+                continue
+            self._push(entry.name, deadline)
+    
+    def _push(self, filename: str, deadline: float):
+        with self._lock:
+            self._deadlines[filename] = deadline
+            heapq.heappush(self._heap, (deadline, filename))
+            is_earliest = self._heap[0][1] == filename and self._heap[0][0] == deadline
+        # Only wake the cleanup thread if it is now waiting too long
+        if is_earliest:
+            self._wake.set()
+    
+    def start(self):
+        """Start the background cleanup thread"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._cleanup_loop, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop the background cleanup thread"""
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        if self._deleter:
+            self._deleter.shutdown(wait=False)
+            self._deleter = None
+    
+    def _cleanup_loop(self):
+        """Delete files as their deadlines pass, sleeping until the next one is due"""
+        while self._running:
+            with self._lock:
+                timeout = max(0.0, self._heap[0][0] - time.time()) if self._heap else None
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._running:
+                self.cleanup_old_files()
+    
+    def schedule_file(self, file_path: str):
+        """
+        Track a newly written temp file for deletion after max_age_seconds
+        
+        Args:
+            file_path: Path (or name) of a file inside temp_dir
+        """
+        self._push(os.path.basename(file_path), time.time() + self.max_age_seconds)
     
     def cleanup_old_files(self) -> int:
         """
-        Remove files older than max_age_seconds
+        Remove tracked files whose deletion deadline has passed
         
         Returns:
             Number of files deleted
         """
         try:
             current_time = time.time()
-            deleted_count = 0
-            
-            # Find all image files in temp directory
-            patterns = ['*.jpg', '*.jpeg', '*.png']
-            files_to_check = []
             
-            for pattern in patterns:
-                files_to_check.extend(glob.glob(os.path.join(self.temp_dir, pattern)))
+            # Pop only the entries whose deadline has passed
+            due = []
+            with self._lock:
+                while self._heap and self._heap[0][0] <= current_time:
+                    deadline, filename = heapq.heappop(self._heap)
+                    # Skip stale heap entries (file rescheduled or already removed)
+                    if self._deadlines.get(filename) == deadline:
+                        del self._deadlines[filename]
+                        due.append(filename)
             
-            for file_path in files_to_check:
-                try:
-                    file_age = current_time - os.path.getmtime(file_path)
-                    
-                    if file_age > self.max_age_seconds:
-                        os.remove(file_path)
-                        deleted_count += 1
-                        logger.debug(f"🗑️ Deleted old temp file: {os.path.basename(file_path)}")
-                except Exception as e:
-                    logger.warning(f"Failed to delete {file_path}: {e}")
+            if len(due) > 1:
+                # Bursts of due files are unlinked in parallel (I/O-bound on slow storage)
+                deleted_count = sum(self._get_deleter().map(self._remove_due_file, due))
+            else:
+                deleted_count = sum(map(self._remove_due_file, due))
             
             if deleted_count > 0:
                 logger.info(f"🧹 Cleaned up {deleted_count} old temp files")
@@ -62,6 +143,23 @@ class TempFileCleanup:
             logger.error(f"❌ Temp file cleanup failed: {e}")
             return 0
     
+    def _get_deleter(self) -> ThreadPoolExecutor:
+        if self._deleter is None:
+            self._deleter = ThreadPoolExecutor(max_workers=DELETE_WORKERS, thread_name_prefix="temp-cleanup")
+        return self._deleter
+    
+    def _remove_due_file(self, filename: str) -> bool:
+        file_path = os.path.join(self.temp_dir, filename)
+        try:
+            os.remove(file_path)
+            logger.debug(f"🗑️ Deleted old temp file: {filename}")
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"Failed to delete {file_path}: {e}")
+            return False
+    
     def cleanup_specific_file(self, filename: str) -> bool:
         """
         Delete a specific file
@@ -73,11 +171,12 @@ class TempFileCleanup:
             True if deleted, False otherwise
         """
         try:
-            file_path = os.path.join(self.temp_dir, filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.debug(f"🗑️ Deleted temp file: {filename}")
-                return True
+            with self._lock:
+                self._deadlines.pop(filename, None)
+            os.remove(os.path.join(self.temp_dir, filename))
+            logger.debug(f"🗑️ Deleted temp file: {filename}")
+            return True
+        except FileNotFoundError:
             return False
         except Exception as e:
             logger.warning(f"Failed to delete {filename}: {e}")
@@ -91,14 +190,9 @@ class TempFileCleanup:
             Tuple of (total_size_mb, file_count)
         """
         try:
-            total_size = 0
-            file_count = 0
-            
-            for pattern in ['*.jpg', '*.jpeg', '*.png']:
-                files = glob.glob(os.path.join(self.temp_dir, pattern))
-                file_count += len(files)
-                for f in files:
-                    total_size += os.path.getsize(f)
+            entries = self._image_entries()
+            file_count = len(entries)
+            total_size = sum(entry.stat().st_size for entry in entries)
             
             size_mb = total_size / (1024 * 1024)
             return (size_mb, file_count)
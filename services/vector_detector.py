@@ -23,7 +23,7 @@ class VectorDetector:
         self.camera_direction = camera_direction
         self.trigger_line_y = trigger_line_y
         
-        # Track vehicle movement history
+        # Track vehicle movement history, in first_seen order
         # {track_id: {'positions': [(bbox, timestamp), ...], 'triggered': bool}}
         self.vehicle_tracks = {}
         
@@ -198,10 +198,13 @@ class VectorDetector:
         """Remove tracks that haven't been updated recently"""
         current_time = time.time()
         
+        # Tracks are inserted once with first_seen, so the dict is ordered by
+        # first_seen: stop at the first track that has not timed out yet
         tracks_to_remove = []
         for track_id, data in self.vehicle_tracks.items():
-            if current_time - data['first_seen'] > self.track_timeout:
-                tracks_to_remove.append(track_id)
+            if current_time - data['first_seen'] <= self.track_timeout:
+                break
+            tracks_to_remove.append(track_id)
         
         for track_id in tracks_to_remove:
             del self.vehicle_tracks[track_id]
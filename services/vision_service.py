@@ -13,16 +13,23 @@ import json
 import subprocess
 import hashlib
 import sys
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Configuration from .env (read once at import, not per request)
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+MODEL_NAME = os.getenv("MODEL_NAME", "qwen2.5vl:3b")
+
 # Default prompt – can be overridden if needed
 DEFAULT_PROMPT = "Read the Indian license plate number from this image and return it in uppercase without any extra text."
 
 # Simple in‑memory cache for image results (key: SHA256 of image bytes)
-_image_cache = {}
+_image_cache = OrderedDict()  # LRU: most recently used at the end
 _CACHE_MAX_SIZE = 100  # limit number of cached entries
+_cache_lock = threading.Lock()
 
 # Try to import Hailo SDK
 try:
@@ -50,12 +57,14 @@ def run_vision_llm(image_path: str, prompt: str = DEFAULT_PROMPT) -> str:
     cache_key = hashlib.sha256(img_bytes).hexdigest()
     
     # Check cache
-    if cache_key in _image_cache:
-        return _image_cache[cache_key]
+    with _cache_lock:
+        if cache_key in _image_cache:
+            _image_cache.move_to_end(cache_key)
+            return _image_cache[cache_key]
 
     # Prepare payload
     payload = {
-        "model": os.getenv("MODEL_NAME", "qwen2.5vl:3b"),
+        "model": MODEL_NAME,
         "stream": False
     }
 
@@ -72,7 +81,7 @@ def run_vision_llm(image_path: str, prompt: str = DEFAULT_PROMPT) -> str:
 
     try:
         result = subprocess.run(
-            ["curl", "-s", "-X", "POST", f"{os.getenv('OLLAMA_HOST', 'http://localhost:11434')}/api/chat",
+            ["curl", "-s", "-X", "POST", f"{OLLAMA_HOST}/api/chat",
              "-H", "Content-Type: application/json",
              "-d", json.dumps(payload)],
             capture_output=True, text=True, check=True
@@ -87,11 +96,12 @@ def run_vision_llm(image_path: str, prompt: str = DEFAULT_PROMPT) -> str:
         # Also remove any leading/trailing whitespace or markdown code blocks
         answer = answer.replace("```", "").strip()
         
-        # Store in cache (evict oldest if over limit)
-        if len(_image_cache) >= _CACHE_MAX_SIZE:
-            # remove arbitrary first key (simple FIFO eviction)
-            _image_cache.pop(next(iter(_image_cache)))
-        _image_cache[cache_key] = answer
+        # Store in cache (evict least recently used if over limit)
+        with _cache_lock:
+            _image_cache[cache_key] = answer
+            _image_cache.move_to_end(cache_key)
+            if len(_image_cache) > _CACHE_MAX_SIZE:
+                _image_cache.popitem(last=False)
         
         return answer
     except Exception as e:
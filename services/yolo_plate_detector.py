@@ -186,18 +186,41 @@ class YOLOPlateDetector:
             plates = []
             
             for result in results:
-                boxes = result.boxes
-                if boxes is not None:
-                    for box in boxes:
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
-                        confidence = box.conf[0].cpu().numpy()
-                        plates.append((x1, y1, x2, y2, confidence))
+                plates.extend(self._result_to_plates(result))
             
             return plates
         except Exception as e:
             print(f"❌ Error detecting plates: {e}")
             return []
     
+    def detect_plates_batch(self, frames: List[np.ndarray]) -> List[List[Tuple[int, int, int, int, float]]]:
+        """
+        Detect license plates in several images with a single model call
+        (one pre/post-processing pass instead of one YOLO invocation per image)
+        Returns: One list of (x1, y1, x2, y2, confidence) tuples per input image
+        """
+        if self.model is None or not frames:
+            return [[] for _ in frames]
+        
+        try:
+            results = self.model(list(frames), conf=self.confidence_threshold, verbose=False)
+            return [self._result_to_plates(result) for result in results]
+        except Exception as e:
+            print(f"❌ Error detecting plates (batch): {e}")
+            return [[] for _ in frames]
+    
+    @staticmethod
+    def _result_to_plates(result) -> List[Tuple[int, int, int, int, float]]:
+        """Convert one ultralytics result into (x1, y1, x2, y2, confidence) tuples"""
+        plates = []
+        boxes = result.boxes
+        if boxes is not None:
+            for box in boxes:
+                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
+                confidence = box.conf[0].cpu().numpy()
+                plates.append((x1, y1, x2, y2, confidence))
+        return plates
+    
     def get_best_plate_roi(self, frame: np.ndarray) -> Optional[np.ndarray]:
         """
         Get the best license plate ROI from frame
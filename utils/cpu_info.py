@@ -0,0 +1,41 @@
+import os
+
+def available_cpu_count():
+    """
+    Number of logical CPUs this process may run on (respects container/affinity limits)
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def physical_core_count():
+    """
+    Number of physical cores (SMT siblings counted once), capped at the CPUs
+    available to this process
+    Returns:
+        int: Physical core count, or the logical count if it cannot be determined
+    """
+    available = available_cpu_count()
+    try:
+        cores = set()
+        physical_id = core_id = None
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                key = key.strip()
+                if key == 'physical id':
+                    physical_id = value.strip()
+                elif key == 'core id':
+                    core_id = value.strip()
+                elif not key and core_id is not None:
+                    # Blank line ends one processor block
+                    cores.add((physical_id, core_id))
+                    physical_id = core_id = None
+        if core_id is not None:
+            cores.add((physical_id, core_id))
+        if cores:
+            return max(1, min(len(cores), available))
+    except OSError:
+        pass
+    return available
@@ -4,24 +4,27 @@ import re
 state_codes = ["AP", "AR", "AS", "BR", "CG", "GA", "GJ", "HR", "HP", "JH", "KA", "KL", "MP", "MH", "MN", "ML", "MZ", "NL", "OD", "PB", "RJ", "SK", "TN", "TS", "TR", "UP", "UK", "WB", "AN", "CH", "DN", "DL", "JK", "LA", "LD", "PY"]
 bh_series = "BH"  # Bharat Series - National registration
 
+# Set for O(1) state code lookup
+STATE_CODE_SET = frozenset(state_codes)
+
+# Standard format: AA00AA0000
+STANDARD_PLATE_RE = re.compile(r"^([A-Z]{2})(\d{2})([A-Z]{1,3})(\d{4})$")
+
+# BH Series format: YYBH####XX (YY=Year, BH=Bharat, ####=Random digits, XX=Random letters excluding I,O)
+BH_PLATE_RE = re.compile(r"^(\d{2})(BH)(\d{4})([A-HJ-NP-Z]{2})$")
+
 def validate_license_plate(plate):
     """Validate Indian license plate format"""
     plate = plate.upper().replace(" ", "")
     
-    # Standard format: AA00AA0000
-    standard_pattern = r"^([A-Z]{2})(\d{2})([A-Z]{1,3})(\d{4})$"
-    
-    # BH Series format: YYBH####XX (YY=Year, BH=Bharat, ####=Random digits, XX=Random letters excluding I,O)
-    bh_pattern = r"^(\d{2})(BH)(\d{4})([A-HJ-NP-Z]{2})$"
-    
-    if re.match(standard_pattern, plate):
+    if STANDARD_PLATE_RE.match(plate):
         # Check if state code is valid
         state_code = plate[:2]
-        if state_code in state_codes:
+        if state_code in STATE_CODE_SET:
             return "standard"
         else:
             return "invalid_state"
-    elif re.match(bh_pattern, plate):
+    elif BH_PLATE_RE.match(plate):
         # Validate BH series: letters should exclude I and O
         letters = plate[-2:]
         if 'I' not in letters and 'O' not in letters:
@@ -0,0 +1,27 @@
+import os
+import struct
+
+# JPEG start-of-frame markers (SOF0-SOF15, excluding DHT, JPG and DAC)
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def jpeg_size(image_path):
+    """
+    Read the image dimensions from the JPEG frame header without decoding
+    Returns:
+        tuple: (height, width), or None if the file is not a JPEG
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            if f.read(2) != b'\xff\xd8':
+                return None
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                if marker[1] in _JPEG_SOF_MARKERS:
+                    f.read(3)  # segment length + sample precision
+                    return struct.unpack('>HH', f.read(4))
+                length, = struct.unpack('>H', f.read(2))
+                f.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
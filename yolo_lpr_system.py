@@ -119,7 +119,7 @@ class DummyVideoCapture:
                 INSERT INTO vehicle_logs 
                 (plate, vehicle_type, timestamp, confidence, image_path, roi_image_path, yolo_confidence, api_response)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (plate, vehicle_type, timestamp, confidence, image_path, roi_path, yolo_conf, json.dumps(api_response)))
+            ''', (plate, vehicle_type, timestamp, confidence, image_path, roi_path, yolo_conf, json.dumps(api_response, separators=(',', ':'))))
             
             conn.commit()
             conn.close()